@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.model_selection import train_test_split
+from sklearn.cluster import DBSCAN
+
+from preprocess import DataPreprocessor
+from cluster_model import cluster_model
+from clustering import build_kmeans, partition_labels
+from regressors import fit_regressor_job
+from poly_features import FoldPolynomialFeatures
+from data_cache import load_house_data
+from synthetic_data import HouseDataGenerator
+
+
+# Staged benchmarks of the price prediction pipeline
+# Every stage of a price_predict.py fold is timed on its own (wall and CPU seconds) at several dataset sizes,
+# and the results are written to a JSON file that can be compared against the file of another commit:
+#   python benchmark.py --sizes=21613,100000,1000000 --regressors=knn,lr,xgboost
+#   python benchmark.py --compare=./data/benchmarks/a.json,./data/benchmarks/b.json
+
+# Size of kc_house_data.csv (the DBSCAN eps is scaled from the density of this many rows)
+base_rows = 21613
+
+default_sizes = [21613, 100000, 1000000]
+default_regressors = ['knn', 'lr', 'pr2', 'decisiontree', 'xgboost']
+
+
+# n listings for a benchmark run: the real rows when n is the size of the real file, otherwise
+# rows drawn from a HouseDataGenerator fitted on them (see synthetic_data.py)
+# Returns: (X, Y) with the columns price_predict.py trains on
+def get_bench_rows(X_0, generator, n, random_state=None):
+    X = X_0 if n == len(X_0) else generator.sample(n, random_state=random_state)
+    Y = pd.DataFrame(X['price'].to_numpy(copy=True), columns=['price'])
+    return X.drop(['price', 'date', 'id', 'zipcode'], axis=1).reset_index(drop=True), Y
+
+
+# Times stages with wall clock and process CPU time
+# Returns records of {'stage', 'n_rows', 'repeat', 'wall', 'cpu'}
+class StageTimer(object):
+    def __init__(self, n_rows, repeat=0):
+        self.n_rows = n_rows
+        self.repeat = repeat
+        self.records = []
+
+    def run(self, stage, fn, *args, **kwargs):
+        print('\t%s (%d rows)...' % (stage, self.n_rows))
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        self.records.append({'stage' : stage, 'n_rows' : self.n_rows, 'repeat' : self.repeat, 'wall' : wall, 'cpu' : cpu})
+        print('\t\t%.3fs wall, %.3fs cpu' % (wall, cpu))
+        return result
+
+
+def fit_poly_regressor(regressor, X_train, Y_train, random_state=None):
+    expansion = FoldPolynomialFeatures(list(X_train.columns), degree=int(regressor[2])).fit(X_train)
+    return fit_regressor_job('none', 0, 'lr', expansion.transform(X_train), Y_train, random_state=random_state)
+
+
+# Runs every stage once on n rows (see get_bench_rows)
+# The CSV stages read a copy of the rows written to work_dir (writing it is not timed)
+def run_stages(X_0, generator, n, regressors, work_dir, repeat=0, default_eps=0.0175, default_ms=100, n_clusters=7,
+    random_state=None):
+    timer = StageTimer(n, repeat)
+    X, Y = get_bench_rows(X_0, generator, n, random_state=random_state)
+
+    # CSV load: parsing with pandas, then building and reading the binary column cache (see data_cache.py)
+    csv_path = os.path.join(work_dir, 'bench_%d.csv' % (n))
+    cache_dir = os.path.join(work_dir, 'bench_%d_cache' % (n))
+    pd.concat([X, Y], axis=1).to_csv(csv_path, index=False)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    timer.run('csv_load', pd.read_csv, csv_path)
+    timer.run('cache_build', load_house_data, csv_path, cache_dir=cache_dir)
+    timer.run('cache_load', load_house_data, csv_path, cache_dir=cache_dir)
+
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=random_state)
+
+    dp = timer.run('preprocessor', DataPreprocessor, input_split=True, xtrain=X_train, xtest=X_test, ytrain=Y_train, ytest=Y_test,
+        omit_norm_features=[], drop_features=[])
+    timer.run('mrmr', dp.mRMR, k=10, verbose=0)
+
+    # Lat/long clustering (eps shrinks with the density so the DBSCAN neighborhoods keep their size)
+    latlong = np.asarray(X_train[['lat', 'long']], dtype=np.float64)
+    eps = default_eps * np.sqrt(base_rows / n)
+    kmeans = timer.run('kmeans', build_kmeans(n_clusters, random_state=random_state).fit, latlong)
+    timer.run('dbscan', DBSCAN(eps=eps, min_samples=default_ms).fit, latlong)
+
+    def partition(labels):
+        order, clusters, starts, stops = partition_labels(labels)
+        X_sorted = X_train.iloc[order]
+        return [X_sorted.iloc[start:stop] for start, stop in zip(starts, stops)]
+    timer.run('partition', partition, kmeans.labels_)
+
+    # Per-regressor fits on the whole normalized train split
+    for regressor in regressors:
+        if regressor in ('pr2', 'pr3'):
+            timer.run('fit_' + regressor, fit_poly_regressor, regressor, dp.X_train, dp.Y_train['price'], random_state)
+        else:
+            timer.run('fit_' + regressor, fit_regressor_job, 'none', 0, regressor, dp.X_train, dp.Y_train['price'],
+                random_state=random_state)
+
+    # Whole cluster model (KMeans clusters only), then its evaluation
+    cm = timer.run('cluster_model', cluster_model, X, Y, X_train, X_test, Y_train, Y_test, cluster_methods=['kmeans'],
+        regressors=regressors, plot_clusters=False, cluster_plots=False, copy_data=False, random_state=random_state)
+    timer.run('evaluate', cm.evaluate, verbose=0)
+
+    return timer.records
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Runs the stages at every size, repeat times each
+# Returns: {'meta' : {...}, 'results' : [records]}
+def run_benchmark(sizes=default_sizes, regressors=default_regressors, repeat=1, data_path='./data/kc_house_data.csv',
+    random_state=0):
+    X_0 = load_house_data(data_path)
+    generator = HouseDataGenerator().fit(X_0)
+
+    records = []
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        for n in sizes:
+            for i in range(repeat):
+                print('Benchmarking %d rows (repeat %d / %d)' % (n, i+1, repeat))
+                records.extend(run_stages(X_0, generator, n, regressors, work_dir, repeat=i, random_state=random_state))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    meta = {
+        'commit'     : get_commit(),
+        'time'       : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python'     : platform.python_version(),
+        'numpy'      : np.__version__,
+        'pandas'     : pd.__version__,
+        'sklearn'    : sklearn.__version__,
+        'cpu_count'  : os.cpu_count(),
+        'sizes'      : list(sizes),
+        'regressors' : list(regressors),
+        'repeat'     : repeat
+    }
+    return {'meta' : meta, 'results' : records}
+
+
+def save_benchmark(bench, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(bench, f, indent=1)
+
+
+# Median wall / cpu time of every (stage, n_rows) in a benchmark file
+def summarize_benchmark(path):
+    with open(path) as f:
+        bench = json.load(f)
+    return pd.DataFrame(bench['results']).groupby(['stage', 'n_rows'], sort=False)[['wall', 'cpu']].median()
+
+
+# Side by side median wall times of two benchmark files, with the new / old ratio
+def compare_benchmarks(old_path, new_path):
+    old, new = summarize_benchmark(old_path), summarize_benchmark(new_path)
+    table = pd.DataFrame({'old_wall' : old['wall'], 'new_wall' : new['wall']})
+    table['ratio'] = table['new_wall'] / table['old_wall']
+    return table
+
+
+# Command-line Argument handler
+def handle_cl_args():
+    sizes = default_sizes
+    regressors = default_regressors
+    repeat = 1
+    outPath = None
+    compare = None
+
+    opts, args = getopt.getopt(sys.argv[1:], 'ho:', ['help', 'sizes=', 'regressors=', 'repeat=', 'out=', 'compare='])
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            sys.exit(2)
+        elif opt == '--sizes':
+            sizes = [int(size) for size in arg.split(',')]
+        elif opt == '--regressors':
+            regressors = arg.split(',')
+        elif opt == '--repeat':
+            repeat = int(arg)
+        elif opt in ('-o', '--out'):
+            outPath = arg
+        elif opt == '--compare':
+            compare = arg.split(',')
+
+    return (sizes, regressors, repeat, outPath, compare)
+
+
+if __name__ == '__main__':
+    sizes, regressors, repeat, outPath, compare = handle_cl_args()
+
+    if compare:
+        print(compare_benchmarks(compare[0], compare[1]).to_string(float_format='%.3f'))
+        sys.exit(0)
+
+    bench = run_benchmark(sizes, regressors, repeat)
+    if outPath is None:
+        outPath = './data/benchmarks/bench_%s.json' % (bench['meta']['commit'])
+    save_benchmark(bench, outPath)
+    print(summarize_benchmark(outPath).to_string(float_format='%.3f'))
+    print('Benchmark results written to %s' % (outPath))
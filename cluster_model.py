@@ -4,7 +4,14 @@ import sys
 from plotting import *
 from preprocess import *
 from sklearn.metrics import r2_score, mean_squared_error
-from scipy.spatial import distance
+from clustering import *
+from regressors import *
+from scoring import *
+from split_store import *
+from poly_features import *
+from tracing import null_tracer
+from updates import update_model
+from feature_ranking import rank_features, cut_ranking
 from sklearn.cluster import KMeans, DBSCAN
 from sklearn.preprocessing import PolynomialFeatures, StandardScaler
 from sklearn.ensemble import RandomForestRegressor, AdaBoostRegressor, GradientBoostingRegressor, BaggingRegressor
@@ -17,13 +24,21 @@ import xgboost
 class cluster_model(object):
     def __init__(self, X, Y, X_train, X_test, Y_train, Y_test, cluster_type='latlong', 
     cluster_methods=['dbscan', 'kmeans', 'none'], regressors=['knn'], plot_clusters=True, 
-    plotDir='./figures', doMRMR=False, doRF=False):
-        self.X = X.copy()
-        self.Y = Y.copy()
-        self.X_train = X_train.copy()
-        self.X_test  = X_test.copy()
-        self.Y_train = Y_train.copy()
-        self.Y_test  = Y_test.copy()
+    plotDir='./figures', doMRMR=False, doRF=False, n_jobs=1, n_cores=None, random_state=None, copy_data=True,
+    cluster_plots=True, plot_queue=None, split_store=None, fold=0, poly_dtype=np.float64,
+    kmeans_args=None, dbscan_args=None, tune_regressors=False, tuning_args=None, early_stopping=False,
+    early_stopping_args=None, tracer=None, rf_rank_args=None):
+        # The input frames are only read, so callers that already own a copy can skip this one
+        if copy_data:
+            X, Y = X.copy(), Y.copy()
+            X_train, X_test = X_train.copy(), X_test.copy()
+            Y_train, Y_test = Y_train.copy(), Y_test.copy()
+        self.X = X
+        self.Y = Y
+        self.X_train = X_train
+        self.X_test  = X_test
+        self.Y_train = Y_train
+        self.Y_test  = Y_test
         self.cluster_type = cluster_type
         self.cluster_methods = cluster_methods
         self.regressors = regressors
@@ -32,6 +47,32 @@ class cluster_model(object):
         self.test_size = 0.2
         self.doMRMR = doMRMR
         self.doRF = doRF
+        self.n_jobs = n_jobs
+        self.n_cores = n_cores
+        self.random_state = random_state
+        # Per-cluster plots are rendered through plot_queue (inline when no queue is given)
+        self.cluster_plots = cluster_plots
+        self.plot_queue = plot_queue if plot_queue is not None else PlotQueue(n_workers=0)
+        # Preprocessed cluster splits are saved to split_store (see split_store.py) under (fold, method, cluster)
+        self.split_store = split_store
+        self.fold = fold
+        # Poly regression features can be expanded in float32 to halve their memory
+        self.poly_dtype = poly_dtype
+        # Options for __find_best_kmeans, e.g. {'precomputed' : False} to sweep k and pick the elbow
+        self.kmeans_args = kmeans_args if kmeans_args is not None else {}
+        # Options for __find_best_dbscan, e.g. {'eps_vals' : [...], 'core_neighbors_vals' : [...]} to run a grid
+        self.dbscan_args = dbscan_args if dbscan_args is not None else {}
+        # Per-cluster successive halving search of the regressor hyperparameters (see regressors.successive_halving)
+        self.tune_regressors = tune_regressors
+        self.tuning_args = tuning_args if tuning_args is not None else {}
+        # gradientboosting / xgboost stop adding rounds once held-out rows stop improving (see regressors.fit_early_stopping)
+        self.early_stopping = early_stopping
+        self.early_stopping_args = early_stopping_args if early_stopping_args is not None else {}
+        # Options for the doRF feature ranking, e.g. {'subsample' : 0.25, 'mode' : 'permutation'} (see feature_ranking.rank_features)
+        # The forest uses the n_cores budget unless rf_rank_args sets n_jobs
+        self.rf_rank_args = dict({'n_jobs' : n_cores if n_cores is not None else -1}, **(rf_rank_args or {}))
+        # Timing spans of the build stages and of every fit / predict call (see tracing.Tracer, disabled by default)
+        self.tracer = tracer if tracer is not None else null_tracer
 
         if doRF and doMRMR:
             print('Set doMRMR=True or doRF=True, not both.')
@@ -52,21 +93,24 @@ class cluster_model(object):
         elif doRF:
             self.dp = DataPreprocessor(input_split=True, xtrain=self.X_train, xtest=self.X_test, ytrain=self.Y_train, ytest=self.Y_test,
                 omit_norm_features=[], drop_features=[], save_dir='./data/none')
-            self.selected_features = self.dp.rf_rank(n_estimators=100, threshold=0.01)
+            self.selected_features = self.dp.rf_rank(n_estimators=100, threshold=0.01, **self.rf_rank_args)
             print("Selected features: %s" % (str(self.selected_features))) 
         else:
-            self.selected_Features = self.X_train.columns
+            self.selected_features = list(self.X_train.columns)
 
         if cluster_type == 'latlong':
-            self.__latlong_cluster()
+            with self.tracer.span('latlong_cluster', n_rows=len(self.X_train), fold=self.fold):
+                self.__latlong_cluster()
             
-        self.models = self.__build_model()
+        with self.tracer.span('build_model', n_rows=len(self.X_train), fold=self.fold):
+            self.models = self.__build_model()
 
 
     # Preprocesses clusters individually
     # Includes normalization and feature selection with mRMR
     def __preprocess_clusters(self):
         print('Preprocessing clusters individually...')
+        poly_expansions = self.__expand_poly_features()
         for method in self.cluster_methods:
             clusters = self.__get_cluster_labels(method)
             for cluster in clusters:
@@ -75,42 +119,51 @@ class cluster_model(object):
                 save_dir='./data/'+str(method)+'/'+str(cluster), test_size=self.test_size, normalize_labels=False, save_plots=False, 
                 plotDir=self.plotDir+'/'+str(method)+'/'+str(cluster), input_split=True, omit_norm_features=[])
                 self.models[method][cluster]['preprocessed_data'] = preprocessed_data
+                self.models[method][cluster]['transform_state'] = preprocessed_data.get_transform_state()
+                if self.split_store is not None:
+                    self.split_store.save(self.fold, method, cluster, preprocessed_data.X_train, preprocessed_data.X_test,
+                        preprocessed_data.Y_train, preprocessed_data.Y_test)
 
 
-                self.models[method][cluster]['X_train'] = preprocessed_data.X_train[self.selected_features].copy()
-                self.models[method][cluster]['X_test']  = preprocessed_data.X_test[self.selected_features].copy()
-                self.models[method][cluster]['Y_train'] = preprocessed_data.Y_train.copy()
-                self.models[method][cluster]['Y_test']  = preprocessed_data.Y_test.copy()
-
                 # In case a feature has the same value for every data point in a cluster 
-                columns = self.models[method][cluster]['X_train'].columns
-                for column in columns:
-                    if len(list(set(preprocessed_data.X_train[column]))) <= 1:
-                        self.models[method][cluster]['X_train'].drop(column, axis=1, inplace=True)
-                        self.models[method][cluster]['X_test'].drop(column, axis=1, inplace=True)
+                constant = constant_columns(preprocessed_data.X_train[self.selected_features])
+                features = [feature for feature, is_constant in zip(self.selected_features, constant) if not is_constant]
+
+                self.models[method][cluster]['X_train'] = preprocessed_data.X_train[features]
+                self.models[method][cluster]['X_test']  = preprocessed_data.X_test[features]
+                self.models[method][cluster]['Y_train'] = preprocessed_data.Y_train
+                self.models[method][cluster]['Y_test']  = preprocessed_data.Y_test
+                self.models[method][cluster]['features'] = features
 
 
                 
 
 
-                # Create separate sets of features for poly regression
-                for regressor in self.regressors:
-                    if regressor == 'pr2':
-                        self.models[method][cluster]['pr2'] = {}
-                        self.models[method][cluster]['pr2']['poly_transform'] = PolynomialFeatures(degree=2, interaction_only=False, include_bias=False)
-                        poly = self.models[method][cluster]['pr2']['poly_transform']
-                        ss = StandardScaler(with_std=True)
-                        self.models[method][cluster]['pr2']['X_train'] = ss.fit_transform(poly.fit_transform(self.models[method][cluster]['X_train'].copy()))#[self.models[method][cluster]['X_train'].columns[0:3]].copy()))
-                        self.models[method][cluster]['pr2']['X_test'] = ss.fit_transform(poly.transform(self.models[method][cluster]['X_test'].copy()))#[self.models[method][cluster]['X_train'].columns[0:3]].copy()))
-                    elif regressor == 'pr3':
-                        self.models[method][cluster]['pr3'] = {}
-                        self.models[method][cluster]['pr3']['poly_transform'] = PolynomialFeatures(degree=3, interaction_only=False, include_bias=False)
-                        poly = self.models[method][cluster]['pr3']['poly_transform']
-                        ss = StandardScaler(with_std=True)
-                        self.models[method][cluster]['pr3']['X_train'] = ss.fit_transform(poly.fit_transform(self.models[method][cluster]['X_train'].copy()))#[self.models[method][cluster]['X_train'].columns[0:3]].copy()))
-                        self.models[method][cluster]['pr3']['X_test'] = ss.fit_transform(poly.transform(self.models[method][cluster]['X_test'].copy()))#[self.models[method][cluster]['X_train'].columns[0:3]].copy()))
+                # Poly regression features are row slices of the fold-wide expansion
+                for regressor, expansion in poly_expansions.items():
+                    poly = ClusterPolyTransform(expansion['expansion'], features)
+                    self.models[method][cluster][regressor] = {}
+                    self.models[method][cluster][regressor]['poly_transform'] = poly
+                    self.models[method][cluster][regressor]['X_train'] = poly.fit_transform_rows(expansion['X_train'], self.models[method][cluster]['train_inds'])
+                    self.models[method][cluster][regressor]['X_test']  = poly.transform_rows(expansion['X_test'], self.models[method][cluster]['test_inds'])
+
+
 
+    # Expands the selected features of the whole fold once for each poly regressor (pr2 / pr3)
+    # Returns: {regressor: {'expansion', 'X_train', 'X_test'}}
+    def __expand_poly_features(self):
+        poly_expansions = {}
+        for regressor in self.regressors:
+            if regressor == 'pr2' or regressor == 'pr3':
+                expansion = FoldPolynomialFeatures(self.selected_features, degree=int(regressor[2]), dtype=self.poly_dtype)
+                expansion.fit(self.X_train)
+                poly_expansions[regressor] = {
+                    'expansion' : expansion,
+                    'X_train'   : expansion.transform(self.X_train),
+                    'X_test'    : expansion.transform(self.X_test)
+                }
 
+        return poly_expansions
 
 
     # Clustering based on lat long data
@@ -133,32 +186,25 @@ class cluster_model(object):
         self.cluster_features = latlong
         for method in self.cluster_methods:
             if method == 'kmeans':
-                self.__find_best_kmeans()
+                self.__find_best_kmeans(**self.kmeans_args)
             elif method == 'dbscan':
-                self.__find_best_dbscan()
+                self.__find_best_dbscan(**self.dbscan_args)
 
-    def __find_best_dbscan(self, eps_vals=None, core_neighbors_vals=None, createPlots=True, precomputed=True, default_eps=0.0175, default_ms=100):
+    def __find_best_dbscan(self, eps_vals=None, core_neighbors_vals=None, createPlots=True, precomputed=True, default_eps=0.0175, default_ms=100, eps_metric='euclidean'):
         print('Getting DBSCAN clustering')
         if not precomputed:
-            max_k = 100
-            k_nearest_distances = np.zeros((max_k, len(self.X_train)))
-
             # Getting distances between k-nearest neighbors in specified range
-            cdist_matrix = distance.cdist(self.X_train[['lat', 'long']], self.X_train[['lat', 'long']])
-            np.fill_diagonal(cdist_matrix, sys.maxsize)
-            for i in range(len(self.X_train)):
-                k_nearest_distances[:,i] = cdist_matrix[i, np.argpartition(cdist_matrix[i,:], max_k)[:max_k]]
-            k_nearest_distances = np.sort(k_nearest_distances, axis=1)
+            max_k = 100
+            # (eps_metric='haversine' gives great circle curves for inspection, not eps values for the Euclidean DBSCAN)
+            k_nearest_distances = get_k_nearest_distances(self.X_train[['lat', 'long']], max_k=max_k, metric=eps_metric)
+            max_k = len(k_nearest_distances)
 
             # Getting best eps for each value of k
             # (Maximize 2nd derivative to find best eps)
-            optimal_eps = np.zeros(max_k)
-            distances_2nd_diff = np.diff(k_nearest_distances, n=2, axis=1)
-            max_diffs = np.argmax(distances_2nd_diff, axis=1)
-            for i in range(max_k):
-                optimal_eps[i] = k_nearest_distances[i, max_diffs[i]]
+            optimal_eps = get_optimal_eps(k_nearest_distances)
+            self.k_nearest_distances = k_nearest_distances
+            self.optimal_eps = optimal_eps
 
-        
             if createPlots:
                 save_dir = self.plotDir + '/dbscan/eps_neighbor_search/'
                 os.makedirs(save_dir, exist_ok=True)
@@ -168,141 +214,152 @@ class cluster_model(object):
 
             
         # DBSCAN clustering
-        # (Fixing min_samples = 50 here)
-        core_neighbors_vals = [default_ms]
-        eps_vals = [default_eps]
-        for eps in eps_vals:
-            for core_neighors in core_neighbors_vals:
-                    self.dbscan = DBSCAN(eps=eps, min_samples=core_neighors).fit(self.cluster_features)
-                    if (self.plot_clusters):
-                        plot_latlong_clusters(self.X_train['long'], self.X_train['lat'], self.dbscan.labels_, 
-                        save_dir=self.plotDir+"/dbscan", save_name=("latlong_DBSCAN_%s_%s" % (eps, core_neighors)))
+        # (Fixing min_samples = 50 here unless a grid of values is given)
+        if not core_neighbors_vals:
+            core_neighbors_vals = [default_ms]
+        if not eps_vals:
+            eps_vals = [default_eps]
+
+        if len(eps_vals) * len(core_neighbors_vals) == 1:
+            self.dbscan = DBSCAN(eps=eps_vals[0], min_samples=core_neighbors_vals[0]).fit(self.cluster_features)
+            if (self.plot_clusters):
+                plot_latlong_clusters(self.X_train['long'], self.X_train['lat'], self.dbscan.labels_, 
+                save_dir=self.plotDir+"/dbscan", save_name=("latlong_DBSCAN_%s_%s" % (eps_vals[0], core_neighbors_vals[0])))
+        else:
+            # Whole grid from one radius-neighbor graph at the largest eps (see clustering.dbscan_grid)
+            graph = get_radius_graph(self.cluster_features, max(eps_vals))
+            results, self.dbscan_summary = dbscan_grid(self.cluster_features, eps_vals, core_neighbors_vals, graph=graph)
+            print(self.dbscan_summary.to_string(index=False))
+            os.makedirs(self.plotDir+"/dbscan", exist_ok=True)
+            self.dbscan_summary.to_csv(self.plotDir+"/dbscan/dbscan_grid_summary.csv", index=False)
+
+            if (self.plot_clusters):
+                for (eps, core_neighors), (labels, core_inds) in results.items():
+                    plot_latlong_clusters(self.X_train['long'], self.X_train['lat'], labels, 
+                    save_dir=self.plotDir+"/dbscan", save_name=("latlong_DBSCAN_%s_%s" % (eps, core_neighors)))
+
+            # Keeping the default setting if it was part of the grid (the last one otherwise, as before)
+            eps, core_neighors = (default_eps, default_ms) if (default_eps, default_ms) in results else list(results)[-1]
+            self.dbscan = DBSCAN(eps=eps, min_samples=core_neighors, metric='precomputed').fit(threshold_radius_graph(graph, eps))
 
         print('%d different clusters' % len(list(set(self.dbscan.labels_))))
         return self.dbscan
 
-    def __find_best_kmeans(self, krange=None, precomputed=True, default_k=7):
+    # With precomputed=False, sweeps k over krange (see clustering.kmeans_sweep, same defaults) and picks the elbow of the SSE curve
+    def __find_best_kmeans(self, krange=None, precomputed=True, default_k=7, warm_start=False, n_jobs=1, backend='kmeans'):
         print('Finding best kmeans clustering...')
         if not precomputed:
-            sse_vals = []
             if not krange:
                 krange = range(2, 20)
-                # KMeans clustering
-                for nclusters in krange:
-                    self.kmeans = KMeans(n_clusters=nclusters).fit(self.cluster_features)
-                    if (self.plot_clusters):
-                        plot_latlong_clusters(self.X_train['long'], self.X_train['lat'], self.kmeans.labels_, save_dir=self.plotDir+"/kmeans", 
-                        save_name=("latlong_kmeans_%s_clusters" % nclusters))
-
-                    sse_vals.append(self.kmeans.inertia_)
-
-            plot_kmeans_sse(sse_vals)
+            krange = list(krange)
+
+            # KMeans clustering
+            models, sse_vals = kmeans_sweep(self.cluster_features, krange, warm_start=warm_start, n_jobs=n_jobs,
+                backend=backend, random_state=self.random_state)
+            if (self.plot_clusters):
+                for nclusters, model in zip(krange, models):
+                    plot_latlong_clusters(self.X_train['long'], self.X_train['lat'], model.labels_, save_dir=self.plotDir+"/kmeans", 
+                    save_name=("latlong_kmeans_%s_clusters" % nclusters))
+
+            plot_kmeans_sse(sse_vals, krange=krange)
+            self.kmeans_sse = dict(zip(krange, sse_vals))
+
+            best_k = get_elbow(krange, sse_vals)
+            print('Elbow of the SSE curve at k = %d' % (best_k))
+            self.kmeans = models[krange.index(best_k)]
         else:
-            self.kmeans = KMeans(n_clusters=default_k).fit(self.cluster_features)
+            self.kmeans = build_kmeans(default_k, backend, random_state=self.random_state).fit(self.cluster_features)
         return self.kmeans
 
     # Gets cluster train sets for DBSCAN model
     def __get_dbscan_train_sets(self, model):
         model['model'] = self.dbscan
-        for label in self.dbscan.labels_:
-            if label not in model.keys():
-                model[label] = {}
-                model[label]['X_train'] = self.X_train[self.X_train.columns][self.dbscan.labels_ == label]
-                model[label]['Y_train'] = self.Y_train[self.dbscan.labels_ == label]
-                model[label]['n_train'] = len(model[label]['X_train'])
-        
-        model['predictor'] = KNeighborsClassifier(n_neighbors=1)
-        model['predictor'].fit(self.X_train[['lat', 'long']], self.dbscan.labels_)
+        self.__partition(model, self.X_train, self.Y_train, self.dbscan.labels_, 'train')
+
+        # Test rows / new listings are routed from the core samples (see clustering.GridRouter)
+        model['predictor'] = GridRouter(self.dbscan.eps)
+        model['predictor'].fit(self.cluster_features, self.dbscan.labels_, self.dbscan.core_sample_indices_)
 
     # Gets the test sets for a dbscan cluster model 
     def __get_dbscan_test_sets(self):
         predictions = np.array(self.models['dbscan']['predictor'].predict(self.X_test[['lat', 'long']]))
-        cluster_labels = list(set(predictions))
-
-        for label in cluster_labels:
-            self.models['dbscan'][label]['X_test'] = self.X_test[self.X_test.columns][predictions == label]
-            self.models['dbscan'][label]['Y_test'] = self.Y_test[predictions == label]
-            self.models['dbscan'][label]['n_test'] = len(self.models['dbscan'][label]['X_test'])
+        self.__partition(self.models['dbscan'], self.X_test, self.Y_test, predictions, 'test')
             #print('cluster # = %d' % (label))
             #print('\tn_train = %d' % (self.models['dbscan'][label]['n_train']))
             #print('\tn_test = %d' % (self.models['dbscan'][label]['n_test']))
 
 
     # Fits the regressors for all clustering methods
+    # Every (method, cluster, regressor) fit is an independent job, run on a pool of self.n_jobs workers
     def __fit_regressors(self):
         print('Fitting regressors...')
+        jobs = []
         for method in self.cluster_methods:
             clusters = self.__get_cluster_labels(method)
             model = self.models[method]
             for label in clusters:
                 for regressor in self.regressors:
-                    # Training separate knn for each cluster
-                    if regressor == 'knn':
-                        model[label]['knn'] = {}
-                        model[label]['knn']['model'] = KNeighborsRegressor(n_neighbors=5, weights='distance')
-                        model[label]['knn']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'lr':
-                        model[label]['lr'] = {}
-                        model[label]['lr']['model'] = LinearRegression(normalize=True)
-                        model[label]['lr']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'adaboost':
-                        model[label]['adaboost'] = {}
-                        model[label]['adaboost']['model'] = AdaBoostRegressor(n_estimators=100, learning_rate=0.2, loss='exponential')
-                        model[label]['adaboost']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'gradientboosting':
-                        model[label]['gradientboosting'] = {}
-                        model[label]['gradientboosting']['model'] = GradientBoostingRegressor(n_estimators=400, learning_rate=0.1, loss='ls', max_depth=5, min_samples_split=2)
-                        model[label]['gradientboosting']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'randomforest':
-                        model[label]['randomforest'] = {}
-                        model[label]['randomforest']['model'] = RandomForestRegressor(n_estimators=400)
-                        model[label]['randomforest']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'decisiontree':
-                        model[label]['decisiontree'] = {}
-                        model[label]['decisiontree']['model'] = DecisionTreeRegressor()
-                        model[label]['decisiontree']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'xgboost':
-                        model[label]['xgboost'] = {}
-                        model[label]['xgboost']['model'] = xgboost.XGBRegressor(n_estimators=900, learning_rate=0.05, max_depth=5)
-                        model[label]['xgboost']['model'].fit(model[label]['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'pr2':
-                        # Need to create and fit poly features in same function
-                        model[label]['pr2']['model'] = LinearRegression(normalize=True)
-                        model[label]['pr2']['model'].fit(model[label]['pr2']['X_train'], model[label]['Y_train']['price'])
-
-                    elif regressor == 'pr3':
-                        # Need to create and fit poly features in same function
-                        model[label]['pr3']['model'] = LinearRegression(normalize=True)
-                        model[label]['pr3']['model'].fit(model[label]['pr3']['X_train'], model[label]['Y_train']['price'])
+                    # Poly regression uses the expanded features created in __preprocess_clusters
+                    if regressor == 'pr2' or regressor == 'pr3':
+                        X_train = model[label][regressor]['X_train']
+                    else:
+                        X_train = model[label]['X_train']
+                    jobs.append((method, label, regressor, X_train, model[label]['Y_train']['price']))
+
+        results = fit_regressor_jobs(jobs, n_jobs=self.n_jobs, n_cores=self.n_cores, random_state=self.random_state,
+            tune=self.tune_regressors, tuning_args=self.tuning_args, early_stopping=self.early_stopping,
+            early_stopping_args=self.early_stopping_args, tracer=self.tracer, fold=self.fold)
+
+        self.fit_times = {}
+        self.tuned_params = {}
+        self.stopping_rounds = {}
+        for method, label, regressor, fitted, fit_time, info in results:
+            if regressor not in self.models[method][label].keys():
+                self.models[method][label][regressor] = {}
+            self.models[method][label][regressor]['model'] = fitted
+            self.models[method][label][regressor]['fit_time'] = fit_time
+            self.fit_times[(method, label, regressor)] = fit_time
+
+            # Winners of the successive halving search (None when the regressor kept its configuration)
+            if 'params' in info.keys():
+                self.models[method][label][regressor]['params'] = info['params']
+                self.models[method][label][regressor]['search'] = info['search']
+                self.tuned_params[(method, label, regressor)] = info['params']
+
+            # Boosting rounds kept by early stopping
+            if 'n_rounds' in info.keys():
+                self.models[method][label][regressor]['n_rounds'] = info['n_rounds']
+                self.stopping_rounds[(method, label, regressor)] = info['n_rounds']
+                print('\t%s cluster %s, %s: stopped at round %d (n_train = %d, %.2fs)' % (method, str(label), regressor,
+                    info['n_rounds'], self.models[method][label]['n_train'], fit_time))
 
 
 
     def __get_kmeans_train_and_test_sets(self, model):
         model['model'] = self.kmeans
         # Building training dataset and fitting regressor
-        for label in self.kmeans.labels_:
-            if  label not in model.keys():
-                model[label] = {}
-                model[label]['X_train'] = self.X_train[self.X_train.columns][self.kmeans.labels_ == label]
-                model[label]['Y_train'] = self.Y_train[self.kmeans.labels_ == label]
-                model[label]['n_train'] = len(model[label]['X_train'])
+        self.__partition(model, self.X_train, self.Y_train, self.kmeans.labels_, 'train')
 
         # Building test set
         predictions = self.kmeans.predict(self.X_test[['lat', 'long']])
-        cluster_labels = list(set(predictions))
-        for label in cluster_labels:
-            model[label]['X_test'] = self.X_test[self.X_test.columns][predictions == label]
-            model[label]['Y_test'] = self.Y_test[predictions == label]
-            model[label]['n_test'] = len(model[label]['X_test'])
+        self.__partition(model, self.X_test, self.Y_test, predictions, 'test')
+
+
+    # Splits X / Y into per-cluster sets for a clustering model
+    # The rows are reordered by cluster once, and each cluster gets a contiguous slice of that copy
+    # (plus its row indices in '<split>_inds'), so the partition costs about one copy of the fold
+    def __partition(self, model, X, Y, labels, split):
+        order, clusters, starts, stops = partition_labels(labels)
+        X_sorted = X.iloc[order]
+        Y_sorted = Y.iloc[order]
+        for label, start, stop in zip(clusters, starts, stops):
+            if label not in model.keys():
+                model[label] = {}
+            model[label][split+'_inds'] = order[start:stop]
+            model[label]['X_'+split] = X_sorted.iloc[start:stop]
+            model[label]['Y_'+split] = Y_sorted.iloc[start:stop]
+            model[label]['n_'+split] = stop - start
 
-        
 
 
     # Building entire cluster-based model (including fitting regressors)
@@ -321,13 +378,19 @@ class cluster_model(object):
                 self.models['none'] = {}
                 self.models[method]['model'] = None
                 self.models[method][0] = {}
-                self.models[method][0]['X_train'] = self.X_train.copy()
-                self.models[method][0]['X_test']  = self.X_test.copy()
-                self.models[method][0]['Y_train'] = self.Y_train.copy()
-                self.models[method][0]['Y_test']  = self.Y_test.copy()
-
-        self.__preprocess_clusters()
-        self.__fit_regressors()
+                self.models[method][0]['X_train'] = self.X_train
+                self.models[method][0]['X_test']  = self.X_test
+                self.models[method][0]['Y_train'] = self.Y_train
+                self.models[method][0]['Y_test']  = self.Y_test
+                self.models[method][0]['n_train'] = len(self.X_train)
+                self.models[method][0]['n_test']  = len(self.X_test)
+                self.models[method][0]['train_inds'] = np.arange(len(self.X_train))
+                self.models[method][0]['test_inds']  = np.arange(len(self.X_test))
+
+        with self.tracer.span('preprocess_clusters', n_rows=len(self.X_train), fold=self.fold):
+            self.__preprocess_clusters()
+        with self.tracer.span('fit_regressors', n_rows=len(self.X_train), fold=self.fold):
+            self.__fit_regressors()
         return self.models
 
 
@@ -340,8 +403,39 @@ class cluster_model(object):
         return clusters
 
 
+    # Routes each row of X to its cluster for a clustering method, with one call to the cluster model
+    def get_clusters(self, X, method):
+        return route_clusters(self.models[method], method, X)
+
+
+    # Predicts prices for a DataFrame of new listings (same columns as X_train)
+    # Rows are grouped by cluster so each regressor is called once per cluster
+    # Returns: Array of predicted prices in the same order as the rows of X
+    def predict(self, X, method, regressor):
+        return predict_clusters(self.models[method], method, regressor, X)
+
+
+    # Updates the fitted model with newly sold listings X (same columns as X_train) and their prices Y
+    # Cheap regressors are updated in place, expensive ones are refitted only in clusters that grew or drifted
+    # (see updates.update_model)
+    # Returns: DataFrame with the new rows, updated and refitted regressors of every cluster that got rows
+    def update(self, X, Y, row_threshold=0.25, error_threshold=0.25, min_error_rows=10):
+        with self.tracer.span('update', n_rows=len(X), fold=self.fold):
+            return update_model(self, X, Y, row_threshold, error_threshold, min_error_rows)
+
+
+    # Saves the fitted clusterings, scalers, feature lists and regressors for scoring (see scoring.load_model)
+    def save(self, path):
+        return save_model(self, path)
+
+
     # Evaluates the model on X_test set
     def evaluate(self, verbose=1):
+        with self.tracer.span('evaluate', n_rows=len(self.X_test), fold=self.fold):
+            self.__evaluate(verbose)
+
+
+    def __evaluate(self, verbose=1):
         predictions = {}
         labels      = {}
         self.r2_score = {}
@@ -363,26 +457,32 @@ class cluster_model(object):
 
                 if regressor != 'pr2' and regressor != 'pr3':
                     for cluster in clusters:
-                        these_predictions = self.models[method][cluster][regressor]['model'].predict(
-                            self.models[method][cluster]['X_test']
-                        )
+                        with self.tracer.span('predict', n_rows=self.models[method][cluster]['n_test'], fold=self.fold,
+                            method=method, cluster=cluster, regressor=regressor):
+                            these_predictions = self.models[method][cluster][regressor]['model'].predict(
+                                self.models[method][cluster]['X_test']
+                            )
                         these_labels = self.models[method][cluster]['Y_test']['price']
                         predictions[regressor].extend(these_predictions)
                         labels[regressor].extend(these_labels.to_list())
-                        plot_predictions(these_predictions, these_labels, 
-                            r2_score(these_labels, these_predictions), mean_squared_error(these_labels, these_predictions, squared=False), 
-                            save_dir=self.plotDir+'/'+method+'/'+str(cluster)+'/'+regressor)
+                        if self.cluster_plots:
+                            self.plot_queue.submit(plot_predictions, these_predictions, these_labels,
+                                r2_score(these_labels, these_predictions), mean_squared_error(these_labels, these_predictions, squared=False),
+                                save_dir=self.plotDir+'/'+method+'/'+str(cluster)+'/'+regressor)
                 else:
                     for cluster in clusters:
-                        these_predictions = self.models[method][cluster][regressor]['model'].predict(
-                            self.models[method][cluster][regressor]['X_test']
-                        )
+                        with self.tracer.span('predict', n_rows=self.models[method][cluster]['n_test'], fold=self.fold,
+                            method=method, cluster=cluster, regressor=regressor):
+                            these_predictions = self.models[method][cluster][regressor]['model'].predict(
+                                self.models[method][cluster][regressor]['X_test']
+                            )
                         these_labels = self.models[method][cluster]['Y_test']['price']
                         predictions[regressor].extend(these_predictions)
                         labels[regressor].extend(these_labels.to_list())
-                        plot_predictions(these_predictions, these_labels, 
-                            r2_score(these_labels, these_predictions), mean_squared_error(these_labels, these_predictions, squared=False), 
-                            save_dir=self.plotDir+'/'+method+'/'+str(cluster)+'/'+regressor)
+                        if self.cluster_plots:
+                            self.plot_queue.submit(plot_predictions, these_predictions, these_labels,
+                                r2_score(these_labels, these_predictions), mean_squared_error(these_labels, these_predictions, squared=False),
+                                save_dir=self.plotDir+'/'+method+'/'+str(cluster)+'/'+regressor)
                 
                 self.predictions[method][regressor] = predictions[regressor]
                 self.labels[method][regressor] = labels[regressor]
@@ -448,18 +548,12 @@ class cluster_model(object):
     #############################################################################################################
 
 # Ranks the input features using a random forest algorithm (MSE)
-def rf_rank(X, Y, n_estimators=25, max_depth=None, disp=False, threshold=None):
-    rf = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth)
-    rf.fit(X, Y)
-    feature_importances = zip(X.columns, rf.feature_importances_)
-    feature_importances = sorted(feature_importances, key=lambda tup: abs(tup[1]), reverse=True)
+# rank_args (n_jobs, subsample, max_samples, mode, ...) are passed to feature_ranking.rank_features
+def rf_rank(X, Y, n_estimators=25, max_depth=None, disp=False, threshold=None, **rank_args):
+    feature_importances = rank_features(X, Y, n_estimators=n_estimators, max_depth=max_depth, **rank_args)
 
     if threshold:
-        cutoff = len(feature_importances)
-        for i, importance in enumerate(feature_importances):
-            if importance[1] < threshold:
-                cutoff = i
-        feature_importances = feature_importances[:cutoff]
+        feature_importances = cut_ranking(feature_importances, threshold)
 
     if (disp):
         print('\nTop 10 Features reverse sorted by importance from random forest')
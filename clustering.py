@@ -0,0 +1,278 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from sklearn.neighbors import KDTree, BallTree, NearestNeighbors
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
+from joblib import Parallel, delayed
+
+
+# Distances from every point to its 1st..max_k-th nearest neighbor, using a spatial tree
+# (memory is linear in the number of points, no full distance matrix is built)
+# latlong: (n_samples x 2) array of [lat, long]
+# metric: 'euclidean' (on degrees, the metric DBSCAN uses) or 'haversine' (great circle, returned in degrees of arc).
+#         Haversine distances are not on the scale of the DBSCAN eps values: DBSCAN runs on raw lat/long degrees,
+#         where a degree of longitude is only about cos(47.5) ~ 0.68 degrees of arc in King County, so only the
+#         euclidean curves should be used to pick eps
+# Returns: (max_k x n_samples) array, row k-1 holds the sorted distances to each point's k-th nearest neighbor
+def get_k_nearest_distances(latlong, max_k=100, metric='euclidean', leaf_size=40, block_size=8192):
+    latlong = np.asarray(latlong, dtype=np.float64)
+    n = len(latlong)
+    max_k = min(max_k, n - 1)
+
+    if metric == 'haversine':
+        points = np.radians(latlong)
+        tree = BallTree(points, leaf_size=leaf_size, metric='haversine')
+    else:
+        points = latlong
+        tree = KDTree(points, leaf_size=leaf_size)
+
+    # Querying in fixed size blocks keeps the temporary query arrays bounded
+    # (first neighbor returned is always the point itself, or a duplicate at distance 0)
+    distances = np.empty((max_k, n))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block_distances, _ = tree.query(points[start:stop], k=max_k+1, return_distance=True, sort_results=True)
+        distances[:, start:stop] = block_distances[:, 1:].T
+
+    if metric == 'haversine':
+        distances = np.degrees(distances)
+
+    distances.sort(axis=1)
+    return distances
+
+
+# Gets best eps for each value of k
+# (Maximize 2nd derivative of the sorted k-distance curve to find best eps)
+def get_optimal_eps(k_nearest_distances):
+    distances_2nd_diff = np.diff(k_nearest_distances, n=2, axis=1)
+    max_diffs = np.argmax(distances_2nd_diff, axis=1)
+    return k_nearest_distances[np.arange(len(k_nearest_distances)), max_diffs]
+
+
+# Groups row indices by cluster label with one stable argsort (cost scales with n, not n x clusters)
+# Returns: (order, clusters, starts, stops), rows order[starts[i]:stops[i]] have label clusters[i]
+# and keep their original relative order
+def partition_labels(labels):
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    clusters, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+    return order, clusters, starts, starts + counts
+
+
+# Creates an unfitted KMeans ('kmeans') or MiniBatchKMeans ('minibatch', for large n) model
+def build_kmeans(n_clusters, backend='kmeans', init='k-means++', random_state=None, batch_size=4096):
+    n_init = 1 if not isinstance(init, str) else 10
+    if backend == 'minibatch':
+        return MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init, batch_size=batch_size, random_state=random_state)
+    return KMeans(n_clusters=n_clusters, init=init, n_init=n_init, random_state=random_state)
+
+
+def fit_kmeans(X, n_clusters, backend='kmeans', random_state=None, batch_size=4096):
+    return build_kmeans(n_clusters, backend, random_state=random_state, batch_size=batch_size).fit(X)
+
+
+# Fits KMeans for every k in krange
+# warm_start: each k is seeded from the previous k's centroids plus the point farthest from them (sequential)
+# n_jobs: otherwise the k values are fitted independently in parallel
+# Returns: (list of fitted models, array of inertias), in krange order
+def kmeans_sweep(X, krange=range(2, 20), warm_start=False, n_jobs=1, backend='kmeans', random_state=None, batch_size=4096):
+    X = np.asarray(X, dtype=np.float64)
+    krange = list(krange)
+
+    if not warm_start:
+        models = Parallel(n_jobs=n_jobs)(
+            delayed(fit_kmeans)(X, k, backend, random_state, batch_size) for k in krange
+        )
+        return models, np.array([model.inertia_ for model in models])
+
+    models = []
+    model = fit_kmeans(X, krange[0], backend, random_state, batch_size)
+    models.append(model)
+    for k in krange[1:]:
+        centers = model.cluster_centers_
+        while len(centers) < k:
+            # Next seed is the point farthest from its nearest current center
+            nearest = KDTree(centers).query(X, k=1)[0][:, 0]
+            centers = np.vstack([centers, X[np.argmax(nearest)]])
+        model = build_kmeans(k, backend, init=centers, random_state=random_state, batch_size=batch_size).fit(X)
+        models.append(model)
+
+    return models, np.array([model.inertia_ for model in models])
+
+
+# Picks the elbow of an inertia curve: the k farthest below the line between the first and last points
+# (both axes normalized to [0, 1])
+def get_elbow(krange, inertias):
+    krange = np.asarray(list(krange), dtype=np.float64)
+    inertias = np.asarray(inertias, dtype=np.float64)
+    if len(krange) < 3:
+        return int(krange[np.argmin(inertias)])
+
+    x = (krange - krange[0]) / (krange[-1] - krange[0])
+    span = inertias[0] - inertias[-1]
+    y = (inertias - inertias[-1]) / span if span > 0 else np.zeros(len(inertias))
+    distances = (1 - x) - y
+    return int(krange[np.argmax(distances)])
+
+
+# Sparse radius-neighbor graph (CSR, pairwise distances) of X at max_eps, self-loops included
+# Any DBSCAN with eps <= max_eps can be run on it with metric='precomputed'
+def get_radius_graph(X, max_eps, leaf_size=40):
+    neighbors = NearestNeighbors(radius=max_eps, leaf_size=leaf_size).fit(X)
+    graph = neighbors.radius_neighbors_graph(X, mode='distance')
+    graph.setdiag(0)
+    graph.sort_indices()
+    return graph
+
+
+# Cluster counts, noise fraction and cluster sizes of one DBSCAN labelling
+def get_dbscan_summary(labels):
+    labels = np.asarray(labels)
+    sizes = np.bincount(labels[labels >= 0]) if np.any(labels >= 0) else np.zeros(0, dtype=int)
+    sizes = sizes[sizes > 0]
+    return {
+        'n_clusters'     : len(sizes),
+        'noise_fraction' : np.mean(labels == -1),
+        'min_size'       : sizes.min() if len(sizes) else 0,
+        'median_size'    : np.median(sizes) if len(sizes) else 0,
+        'max_size'       : sizes.max() if len(sizes) else 0
+    }
+
+
+# Keeps the edges of a radius graph with distance <= eps (explicit zeros such as self-loops are kept)
+def threshold_radius_graph(graph, eps):
+    keep = graph.data <= eps
+    counts = np.add.reduceat(keep, graph.indptr[:-1]) if len(keep) else np.zeros(graph.shape[0], dtype=int)
+    counts[np.diff(graph.indptr) == 0] = 0
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    eps_graph = sparse.csr_matrix((graph.data[keep], graph.indices[keep], indptr), shape=graph.shape)
+    eps_graph.has_sorted_indices = graph.has_sorted_indices
+    return eps_graph
+
+
+# DBSCAN labels from a thresholded radius graph (self-loops included), without refitting
+# Core points are the rows with >= min_samples neighbors, clusters are the connected components of the core points
+# (numbered by their first core point) and border points join the lowest-numbered cluster among their core
+# neighbors, which gives the same labels as DBSCAN(min_samples=min_samples).fit (see tests/test_clustering.py)
+# Returns: (labels, core_sample_indices)
+def get_dbscan_labels(eps_graph, min_samples):
+    is_core = np.diff(eps_graph.indptr) >= min_samples
+    core_inds = np.flatnonzero(is_core)
+    labels = np.full(eps_graph.shape[0], -1, dtype=np.intp)
+    if len(core_inds) == 0:
+        return labels, core_inds
+
+    # Core-core edges only (the graph is symmetric, so strong components are the connected components)
+    rows = np.repeat(np.arange(eps_graph.shape[0]), np.diff(eps_graph.indptr))
+    core_edges = is_core[rows] & is_core[eps_graph.indices]
+    core_indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[core_edges], minlength=eps_graph.shape[0]))])
+    core_graph = sparse.csr_matrix((np.ones(core_indptr[-1], dtype=np.int8),
+        eps_graph.indices[core_edges], core_indptr), shape=eps_graph.shape)
+    core_graph.has_sorted_indices = eps_graph.has_sorted_indices
+    components = csgraph.connected_components(core_graph, directed=True, connection='strong')[1][core_inds]
+
+    # Renumbering clusters by their first core point
+    first = np.unique(components, return_index=True)[1]
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+    labels[core_inds] = rank[np.unique(components, return_inverse=True)[1]]
+
+    # Border points: non-core rows with at least one core neighbor
+    border_edges = ~is_core[rows]
+    border_rows = rows[border_edges]
+    neighbor_labels = np.where(is_core[eps_graph.indices[border_edges]], labels[eps_graph.indices[border_edges]],
+        np.iinfo(np.intp).max)
+    border_counts = np.bincount(border_rows, minlength=eps_graph.shape[0])[~is_core]
+    starts = np.concatenate([[0], np.cumsum(border_counts)[:-1]])
+    has_neighbors = border_counts > 0
+    border_labels = np.full(len(starts), np.iinfo(np.intp).max, dtype=np.intp)
+    if len(neighbor_labels):
+        border_labels[has_neighbors] = np.minimum.reduceat(neighbor_labels, starts[has_neighbors])
+    border_labels[border_labels == np.iinfo(np.intp).max] = -1
+    labels[~is_core] = border_labels
+
+    return labels, core_inds
+
+
+# Runs DBSCAN for every (eps, min_samples) pair on one radius graph built at max(eps_vals)
+# (the graph is thresholded once per eps and labelled for every min_samples value from it)
+# Returns: ({(eps, min_samples) : (labels, core_sample_indices)}, summary DataFrame with one row per setting)
+def dbscan_grid(X, eps_vals, min_samples_vals, graph=None):
+    if graph is None:
+        graph = get_radius_graph(X, max(eps_vals))
+
+    results = {}
+    rows = []
+    for eps in eps_vals:
+        eps_graph = threshold_radius_graph(graph, eps)
+        for min_samples in min_samples_vals:
+            labels, core_inds = get_dbscan_labels(eps_graph, min_samples)
+            results[(eps, min_samples)] = (labels, core_inds)
+            rows.append(dict({'eps' : eps, 'min_samples' : min_samples}, **get_dbscan_summary(labels)))
+
+    return results, pd.DataFrame(rows)
+
+
+# Assigns coordinates to DBSCAN clusters from the core samples only
+# Core samples are bucketed in a uniform grid of eps / sqrt(2) cells (every point of a cell is within eps
+# of any core in it, and cores within eps of each other share a cluster, so each cell has one label).
+# Rows in a cell with cores get its label from a sorted cell table, other rows fall back to the nearest core:
+# its label when it is within eps, noise (-1) otherwise (or the nearest core's label if training had no noise)
+# This is a valid DBSCAN border assignment, but not always the nearest core within eps: a row in an occupied
+# cell takes that cell's label even when a closer core of another cluster (more than eps from the cell's cores)
+# is also within eps of it.
+class GridRouter(object):
+    def __init__(self, eps):
+        self.eps = eps
+        self.cell_size = eps / np.sqrt(2)
+
+    # X: (n, 2) coordinates of the training rows, labels: their DBSCAN labels, core_inds: core sample indices
+    def fit(self, X, labels, core_inds):
+        X = np.asarray(X, dtype=np.float64)
+        labels = np.asarray(labels)
+        core_inds = np.asarray(core_inds, dtype=np.intp)
+        self.has_noise = bool(np.any(labels == -1))
+
+        self.core = X[core_inds]
+        self.core_labels = labels[core_inds]
+        if len(core_inds) == 0:
+            self.origin = np.zeros(2)
+            self.n_cols = 1
+            self.cell_keys = np.zeros(0, dtype=np.int64)
+            self.cell_labels = np.zeros(0, dtype=labels.dtype)
+            return self
+
+        self.origin = self.core.min(axis=0)
+        cells = np.floor((self.core - self.origin) / self.cell_size).astype(np.int64)
+        self.n_cols = cells[:, 1].max() + 1
+        self.n_rows = cells[:, 0].max() + 1
+        self.cell_keys, first = np.unique(cells[:, 0] * self.n_cols + cells[:, 1], return_index=True)
+        self.cell_labels = self.core_labels[first]
+        self.tree = KDTree(self.core)
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        predictions = np.full(len(X), -1, dtype=self.cell_labels.dtype)
+        if len(self.core) == 0 or len(X) == 0:
+            return predictions
+
+        # Cell lookup
+        cells = np.floor((X - self.origin) / self.cell_size).astype(np.int64)
+        inside = np.all(cells >= 0, axis=1) & (cells[:, 0] < self.n_rows) & (cells[:, 1] < self.n_cols)
+        keys = cells[:, 0] * self.n_cols + cells[:, 1]
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        hit = inside & (self.cell_keys[pos] == keys)
+        predictions[hit] = self.cell_labels[pos[hit]]
+
+        # Nearest core fallback for rows in cells without cores
+        miss = np.flatnonzero(~hit)
+        if len(miss):
+            distances, nearest = self.tree.query(X[miss], k=1)
+            nearest_labels = self.core_labels[nearest[:, 0]]
+            if self.has_noise:
+                nearest_labels[distances[:, 0] > self.eps] = -1
+            predictions[miss] = nearest_labels
+
+        return predictions
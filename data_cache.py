@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from plotting import featureTypes
+
+
+# Columns of kc_house_data.csv that are not described by featureTypes
+extraTypes = {
+    'id'   : 'id',
+    'date' : 'date'
+}
+
+# Smallest signed int types tried for ordinal / binary / categorical columns
+int_dtypes = [np.int8, np.int16, np.int32, np.int64]
+
+
+# Hash of the source file contents (used to invalidate the cache)
+def get_file_hash(path, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Gets the compact dtype of a column from its featureTypes entry
+# binary / ordinal / categorical columns use the smallest int that holds their range (float32 if not integral),
+# continuous columns are float64, or float32 when float32=True
+def get_column_dtype(column, values, float32=False):
+    feature_type = featureTypes.get(column, extraTypes.get(column, 'continuous'))
+    if feature_type == 'date':
+        return 'datetime64[s]'
+    if feature_type == 'id':
+        return np.int64
+    if feature_type == 'continuous':
+        return np.float32 if float32 else np.float64
+
+    values = np.asarray(values, dtype=np.float64)
+    if np.any(values != np.floor(values)):
+        return np.float32
+    for dtype in int_dtypes:
+        info = np.iinfo(dtype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return dtype
+    return np.int64
+
+
+# Converts the CSV into one .npy file per column, plus a manifest with the schema and source hash
+def build_cache(path, cache_dir, float32=False, source_hash=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    X = pd.read_csv(path, dtype={'date' : str})
+
+    schema = {}
+    for column in X.columns:
+        dtype = get_column_dtype(column, X[column] if column != 'date' else None, float32)
+        if column == 'date':
+            values = pd.to_datetime(X[column], format='%Y%m%dT%H%M%S').to_numpy().astype(dtype)
+        else:
+            values = X[column].to_numpy().astype(dtype)
+        np.save(os.path.join(cache_dir, column + '.npy'), values)
+        schema[column] = np.dtype(dtype).str
+
+    stat = os.stat(path)
+    manifest = {
+        'source'  : os.path.abspath(path),
+        'hash'    : source_hash if source_hash else get_file_hash(path),
+        'size'    : stat.st_size,
+        'mtime'   : stat.st_mtime,
+        'float32' : float32,
+        'columns' : list(X.columns),
+        'schema'  : schema
+    }
+    with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    return manifest
+
+
+# Checks the cache manifest against the source file
+# (size / mtime are checked first, so the file is only re-hashed when it may have changed)
+def get_valid_manifest(path, cache_dir, float32=False):
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None, None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest['float32'] != float32:
+        return None, None
+
+    stat = os.stat(path)
+    if manifest['size'] == stat.st_size and manifest['mtime'] == stat.st_mtime:
+        return manifest, None
+
+    source_hash = get_file_hash(path)
+    if source_hash != manifest['hash']:
+        return None, source_hash
+
+    manifest['mtime'] = stat.st_mtime
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest, source_hash
+
+
+# Loads kc_house_data.csv through the binary column cache, building it the first time
+# Columns are memory-mapped copy-on-write, so loading costs no parsing and little memory
+def load_house_data(path='./data/kc_house_data.csv', cache_dir=None, float32=False, columns=None, mmap=True):
+    if cache_dir is None:
+        cache_dir = os.path.splitext(path)[0] + ('_cache_f32' if float32 else '_cache')
+
+    manifest, source_hash = get_valid_manifest(path, cache_dir, float32)
+    if manifest is None:
+        manifest = build_cache(path, cache_dir, float32, source_hash)
+
+    if columns is None:
+        columns = manifest['columns']
+
+    mmap_mode = 'c' if mmap else None
+    data = {}
+    for column in columns:
+        data[column] = np.load(os.path.join(cache_dir, column + '.npy'), mmap_mode=mmap_mode)
+
+    return pd.DataFrame(data, columns=columns, copy=False)
@@ -0,0 +1,137 @@
+import os
+import hashlib
+import numpy as np
+import joblib
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.inspection import permutation_importance
+
+
+# Hash identifying the rows of a fold: the row index labels (fold indices into the full dataset, X.index
+# unless given), the column names and a salt for anything else that changes the values (e.g. normalization)
+def get_fold_hash(X, index=None, salt=''):
+    sha = hashlib.sha1()
+    sha.update(np.ascontiguousarray(np.asarray(X.index if index is None else index)).tobytes())
+    sha.update(','.join(map(str, X.columns)).encode())
+    sha.update(salt.encode())
+    return sha.hexdigest()
+
+
+# Cheap fingerprint of the values of X and Y: their shapes, column sums and row-position weighted column sums
+# (keeps frames with the same index and columns, or the same X ranked against another label, apart in the cache)
+def get_values_fingerprint(X, Y):
+    sha = hashlib.sha1()
+    for values in (X, Y):
+        values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+        weights = np.arange(1, len(values) + 1, dtype=np.float64)
+        sha.update(np.array(values.shape, dtype=np.int64).tobytes())
+        sha.update(np.nansum(values, axis=0).tobytes())
+        sha.update((weights @ np.nan_to_num(values)).tobytes())
+    return sha.hexdigest()
+
+
+# Fitted forests and importances keyed by fold hash and ranking settings
+# Always kept in memory, and also saved to cache_dir (one joblib file per key) when it is given
+class ImportanceCache(object):
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.entries = {}
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.joblib')
+
+    def get(self, key):
+        if key in self.entries:
+            return self.entries[key]
+        if self.cache_dir is not None and os.path.exists(self.get_path(key)):
+            self.entries[key] = joblib.load(self.get_path(key))
+            return self.entries[key]
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            joblib.dump(value, self.get_path(key))
+        return value
+
+    def clear(self):
+        self.entries = {}
+
+
+# Shared by every ranking in this process unless another cache is given
+default_cache = ImportanceCache()
+
+
+# Fits the random forest used for ranking (or gets it from the cache, when one is given)
+# subsample: fraction (or number) of the rows to fit on, drawn once without replacement
+# max_samples: bootstrap sample size of each tree (fraction or number, see RandomForestRegressor)
+# n_jobs: core budget of the forest
+def fit_ranking_forest(X, Y, n_estimators=25, max_depth=None, n_jobs=1, subsample=None, max_samples=None,
+    random_state=None, fold_hash=None, cache=None):
+    fold_hash = fold_hash if fold_hash is not None else get_fold_hash(X)
+    key = ('forest', fold_hash, get_values_fingerprint(X, Y), n_estimators, max_depth, subsample, max_samples, random_state)
+    forest = cache.get(key) if cache is not None else None
+    if forest is not None:
+        return forest
+
+    y = np.asarray(Y).reshape(len(Y), -1)[:, 0]
+    rows = get_subsample_rows(len(X), subsample, random_state)
+    if rows is not None:
+        X, y = X.iloc[rows], y[rows]
+
+    forest = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth, max_samples=max_samples, n_jobs=n_jobs,
+        random_state=random_state)
+    forest.fit(X, y)
+    return cache.put(key, forest) if cache is not None else forest
+
+
+# Rows of a subsample (None for all rows)
+def get_subsample_rows(n_rows, subsample, random_state=None):
+    if subsample is None:
+        return None
+    n_sub = int(subsample * n_rows) if isinstance(subsample, float) else int(subsample)
+    if n_sub >= n_rows:
+        return None
+    return np.sort(np.random.RandomState(random_state).choice(n_rows, size=max(1, n_sub), replace=False))
+
+
+# Ranks the features of X by random forest importance
+# mode: 'impurity' (the forest's MSE decrease importances) or 'permutation' (R^2 drop when a column is shuffled,
+#       n_repeats times, on up to permutation_rows of the rows, with the cached fitted forest)
+# Importances are cached by fold hash (see get_fold_hash), a fingerprint of the X / Y values and the settings,
+# so ranking the same fold again is free. Fitted forests are only cached in permutation mode (impurity mode
+# never reuses them)
+# Returns: List of (feature, importance), sorted by decreasing absolute importance
+def rank_features(X, Y, n_estimators=25, max_depth=None, n_jobs=1, subsample=None, max_samples=None, mode='impurity',
+    n_repeats=5, permutation_rows=5000, random_state=None, fold_hash=None, cache=default_cache):
+    fold_hash = fold_hash if fold_hash is not None else get_fold_hash(X)
+    key = ('importances', fold_hash, get_values_fingerprint(X, Y), n_estimators, max_depth, subsample, max_samples,
+        random_state, mode)
+    if mode == 'permutation':
+        key += (n_repeats, permutation_rows)
+
+    importances = cache.get(key) if cache is not None else None
+    if importances is None:
+        forest = fit_ranking_forest(X, Y, n_estimators, max_depth, n_jobs, subsample, max_samples, random_state, fold_hash,
+            cache if mode == 'permutation' else None)
+        if mode == 'permutation':
+            y = np.asarray(Y).reshape(len(Y), -1)[:, 0]
+            rows = get_subsample_rows(len(X), permutation_rows, random_state)
+            X_eval, y_eval = (X.iloc[rows], y[rows]) if rows is not None else (X, y)
+            importances = permutation_importance(forest, X_eval, y_eval, n_repeats=n_repeats, n_jobs=n_jobs,
+                random_state=random_state).importances_mean
+        else:
+            importances = forest.feature_importances_
+        if cache is not None:
+            cache.put(key, importances)
+
+    feature_importances = zip(X.columns, importances)
+    return sorted(feature_importances, key=lambda tup: abs(tup[1]), reverse=True)
+
+
+# Keeps the features ranked before the first one with an importance below threshold
+def cut_ranking(feature_importances, threshold):
+    for i, importance in enumerate(feature_importances):
+        if importance[1] < threshold:
+            return feature_importances[:i]
+    return feature_importances
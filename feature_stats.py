@@ -0,0 +1,102 @@
+import numpy as np
+
+
+# Constant columns have no defined correlation, so they get this placeholder instead
+CONSTANT_CORRELATION = 1e-10
+
+
+# Converts a DataFrame / Series / array into a 2-D float matrix (n_samples x n_features)
+def as_matrix(X):
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(-1, 1)
+    return X
+
+
+# Boolean mask of the columns that hold a single value
+def constant_columns(X):
+    X = as_matrix(X)
+    if len(X) == 0:
+        return np.ones(X.shape[1], dtype=bool)
+    return np.all(X == X[0, :], axis=0)
+
+
+# Centers and scales every column to unit norm, so a matrix product gives pearson correlations
+# Constant columns are left as zeros
+def standardize_columns(X):
+    X = as_matrix(X)
+    centered = X - X.mean(axis=0)
+    norms = np.sqrt(np.sum(centered * centered, axis=0))
+    norms[norms == 0] = 1
+    return centered / norms
+
+
+# Pearson correlation of every column of X with the label vector y
+# Columns that are constant get CONSTANT_CORRELATION
+def pearson_correlations(X, y):
+    constant = constant_columns(X)
+    y = as_matrix(y)[:, 0]
+
+    corr = standardize_columns(X).T @ standardize_columns(y)[:, 0]
+    np.clip(corr, -1, 1, out=corr)
+    corr[constant] = CONSTANT_CORRELATION
+
+    return corr
+
+
+# Pearson correlation between every pair of columns of X
+# Pairs involving a constant column get CONSTANT_CORRELATION
+def correlation_matrix(X):
+    constant = constant_columns(X)
+    standardized = standardize_columns(X)
+
+    corr = standardized.T @ standardized
+    np.clip(corr, -1, 1, out=corr)
+    np.fill_diagonal(corr, 1)
+    corr[constant, :] = CONSTANT_CORRELATION
+    corr[:, constant] = CONSTANT_CORRELATION
+
+    return corr
+
+
+# Absolute pearson correlation between every pair of columns of X
+def abs_correlation_matrix(X):
+    return np.abs(correlation_matrix(X))
+
+
+# Most common value of every column (ties go to the value seen first, like statistics.mode)
+def column_modes(X):
+    X = as_matrix(X)
+    modes = np.full(X.shape[1], np.nan)
+    for i in range(X.shape[1]):
+        if len(X) == 0:
+            continue
+        values, first_index, counts = np.unique(X[:, i], return_index=True, return_counts=True)
+        tied = np.flatnonzero(counts == counts.max())
+        modes[i] = values[tied[np.argmin(first_index[tied])]]
+
+    return modes
+
+
+# Gets stats for each feature like mean, stddev, etc...
+# Returns: {column: {'mean', 'median', 'std', 'var', 'mode'}}
+def column_stats(X):
+    columns = list(X.columns)
+    values = as_matrix(X)
+
+    means   = values.mean(axis=0)
+    medians = np.median(values, axis=0)
+    stds    = values.std(axis=0)
+    varis   = values.var(axis=0)
+    modes   = column_modes(values)
+
+    stats = {}
+    for i, column in enumerate(columns):
+        stats[column] = {}
+        stats[column]['mean']   = means[i]
+        stats[column]['median'] = medians[i]
+        stats[column]['std']    = stds[i]
+        stats[column]['var']    = varis[i]
+        stats[column]['mode']   = modes[i]
+
+    return stats
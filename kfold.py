@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from plotting import *
+from cluster_model import *
+
+
+# Base dataset stored once as memory-mapped .npy files
+# Fold workers open the same files read-only, so the full dataset is never copied per process
+# and each fold is built from row indices
+class SharedDataset(object):
+    def __init__(self, X, Y, cache_dir=None):
+        self.temporary = cache_dir is None
+        if self.temporary:
+            cache_dir = tempfile.mkdtemp(prefix='kc_house_')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.columns = list(X.columns)
+        self.label_columns = list(Y.columns)
+        self.X_path = os.path.join(cache_dir, 'X.npy')
+        self.Y_path = os.path.join(cache_dir, 'Y.npy')
+
+        np.save(self.X_path, X.to_numpy(dtype=np.float64))
+        np.save(self.Y_path, Y.to_numpy(dtype=np.float64))
+
+    # Opens the full dataset as DataFrames backed by the read-only memory maps
+    def open(self):
+        X = pd.DataFrame(np.load(self.X_path, mmap_mode='r'), columns=self.columns, copy=False)
+        Y = pd.DataFrame(np.load(self.Y_path, mmap_mode='r'), columns=self.label_columns, copy=False)
+        return X, Y
+
+    # Builds the train / test frames of one fold by row index
+    # (index labels match X_0.iloc[inds] so downstream code sees the same frames as the serial loop)
+    def fold(self, train_inds, test_inds):
+        X = np.load(self.X_path, mmap_mode='r')
+        Y = np.load(self.Y_path, mmap_mode='r')
+        X_train = pd.DataFrame(X[train_inds], index=train_inds, columns=self.columns)
+        X_test  = pd.DataFrame(X[test_inds], index=test_inds, columns=self.columns)
+        Y_train = pd.DataFrame(Y[train_inds], index=train_inds, columns=self.label_columns)
+        Y_test  = pd.DataFrame(Y[test_inds], index=test_inds, columns=self.label_columns)
+        return X_train, X_test, Y_train, Y_test
+
+    # Removes the memory-mapped files if they were written to a temporary directory
+    def cleanup(self):
+        if self.temporary:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+# Trains and evaluates the cluster model for a single fold
+# Only the score dictionaries (plus tuned hyperparameters, stopping rounds and fit times) are returned, so very little data goes back to the parent process
+# Plots go through plot_queue, or a queue of plot_workers processes owned (and flushed) by this fold
+def run_fold(dataset, k_iter, train_inds, test_inds, model_args, savePlots=False, plot_queue=None, plot_workers=2):
+    print('Processing split %d' % (k_iter+1))
+    own_queue = plot_queue is None
+    if own_queue:
+        plot_queue = PlotQueue(n_workers=plot_workers)
+
+    try:
+        X, Y = dataset.open()
+        X_train, X_test, Y_train, Y_test = dataset.fold(train_inds, test_inds)
+
+        if k_iter == 0:
+            plot_queue.submit(plot_pearson_matrix, X_train, Y_train, k=k_iter+1)
+
+        # Creating one specific type of cluster model
+        print('Initializing clustering model...')
+        cm = cluster_model(X, Y, X_train, X_test, Y_train, Y_test, copy_data=False, plot_queue=plot_queue, fold=k_iter+1, **model_args)
+
+        if savePlots:
+            plot_queue.submit(plot_train_test_split, X_train['long'], X_test['long'], X_train['lat'], X_test['lat'], k=k_iter+1)
+
+        cm.evaluate()
+
+        for method in cm.cluster_methods:
+            for regressor in cm.regressors:
+                plot_queue.submit(plot_predictions, cm.predictions[method][regressor], cm.labels[method][regressor],
+                cm.r2_score[method][regressor], cm.rmse[method][regressor], save_dir='./figures/'+method+'/'+regressor+'/'+str(k_iter+1))
+    finally:
+        if own_queue:
+            plot_queue.close()
+
+    return {'r2_score' : cm.r2_score, 'rmse' : cm.rmse, 'tuned_params' : cm.tuned_params,
+        'stopping_rounds' : cm.stopping_rounds, 'fit_times' : cm.fit_times}
+
+
+# Runs every fold of splits, n_jobs folds at a time in separate processes
+# Plots are rendered by plot_workers background processes (one shared queue when the folds run serially)
+# In parallel, the core budget (model_args['n_cores'], all cores by default) and the plot_workers are split
+# between the fold processes, so the regressors' inner threads don't oversubscribe the machine
+# (folds render their plots inline when there is less than one plot worker per fold)
+# Returns: List of score dictionaries (one per fold, in split order)
+def run_folds(dataset, splits, model_args, n_jobs=1, savePlots=False, plot_workers=2):
+    splits = list(splits)
+    n_cores = model_args.get('n_cores') or os.cpu_count() or 1
+    if n_jobs < 0:
+        n_jobs = max(1, n_cores + 1 + n_jobs)
+    n_jobs = min(n_jobs, len(splits))
+    if n_jobs <= 1:
+        plot_queue = PlotQueue(n_workers=plot_workers)
+        try:
+            return [run_fold(dataset, k_iter, train_inds, test_inds, model_args, savePlots, plot_queue=plot_queue)
+                for k_iter, (train_inds, test_inds) in enumerate(splits)]
+        finally:
+            plot_queue.close()
+
+    fold_args = dict(model_args, n_cores=max(1, n_cores // n_jobs))
+    fold_plot_workers = plot_workers // n_jobs
+    return Parallel(n_jobs=n_jobs)(
+        delayed(run_fold)(dataset, k_iter, train_inds, test_inds, fold_args, savePlots, plot_workers=fold_plot_workers)
+        for k_iter, (train_inds, test_inds) in enumerate(splits)
+    )
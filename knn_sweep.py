@@ -0,0 +1,61 @@
+import numpy as np
+
+
+# Column indices of the n_neighbors smallest distances of every row, ties at the n_neighbors-th distance going
+# to the lowest column index (argpartition alone picks among tied columns arbitrarily)
+# Returns: (n_rows, n_neighbors) array, each row in increasing column order
+def get_nearest(distances, n_neighbors):
+    kth = np.partition(distances, n_neighbors - 1, axis=1)[:, n_neighbors - 1, None]
+    closer = distances < kth
+    tied = distances == kth
+    n_tied = n_neighbors - np.sum(closer, axis=1, keepdims=True)
+    selected = closer | (tied & (np.cumsum(tied, axis=1) <= n_tied))
+    return np.nonzero(selected)[1].reshape(len(distances), n_neighbors)
+
+
+# KNN regression scores for every prefix of a feature ordering, from one pass over the pairwise distances
+# Prefixes are nested, so the squared distances with k+1 features are the k-feature distances plus the
+# contribution of one more column. Query rows are processed in blocks: each block's (block x n_fit) squared
+# distance matrix is built up one feature at a time, and the neighbors / predictions of every prefix length
+# are taken from it as it grows, instead of running a new neighbor search for each k.
+# X_query / y_query default to the fit rows (in-sample scoring, each row is its own nearest neighbor)
+# weights: 'distance' (as KNeighborsRegressor, rows at distance 0 share all the weight) or 'uniform'
+# Neighbors tied at the n_neighbors-th distance (duplicate rows, discrete features) are taken in row order
+# (see get_nearest). KNeighborsRegressor picks among them in its tree's traversal order, so its scores only
+# agree exactly when no ties straddle the last neighbor.
+# Returns: Array of R^2 scores, entry k-1 is the score with the first k features of feature_order
+def knn_prefix_sweep(X_fit, y_fit, feature_order, X_query=None, y_query=None, n_neighbors=5, weights='distance',
+    max_k=None, memory_mb=256):
+    max_k = len(feature_order) if max_k is None else min(max_k, len(feature_order))
+    fit = np.asarray(X_fit[list(feature_order[:max_k])], dtype=np.float64)
+    y_fit = np.asarray(y_fit, dtype=np.float64).ravel()
+    if X_query is None:
+        query, y_query = fit, y_fit
+    else:
+        query = np.asarray(X_query[list(feature_order[:max_k])], dtype=np.float64)
+        y_query = np.asarray(y_query, dtype=np.float64).ravel()
+
+    n_neighbors = min(n_neighbors, len(fit))
+    block_size = max(1, int(memory_mb * 2**20 / (8 * len(fit))))
+    predictions = np.empty((max_k, len(query)))
+
+    for start in range(0, len(query), block_size):
+        stop = min(start + block_size, len(query))
+        distances = np.zeros((stop - start, len(fit)))
+        for k in range(max_k):
+            distances += np.square(query[start:stop, k, None] - fit[None, :, k])
+
+            neighbors = get_nearest(distances, n_neighbors)
+            neighbor_y = y_fit[neighbors]
+            if weights == 'distance':
+                neighbor_distances = np.sqrt(np.take_along_axis(distances, neighbors, axis=1))
+                exact = neighbor_distances == 0
+                with np.errstate(divide='ignore'):
+                    weight = np.where(np.any(exact, axis=1)[:, None], exact, 1 / neighbor_distances)
+            else:
+                weight = np.ones(neighbors.shape)
+            predictions[k, start:stop] = np.sum(weight * neighbor_y, axis=1) / np.sum(weight, axis=1)
+
+    residual = np.sum(np.square(predictions - y_query[None, :]), axis=1)
+    total = np.sum(np.square(y_query - y_query.mean()))
+    return 1 - residual / total if total > 0 else np.where(residual == 0, 1.0, 0.0)
@@ -0,0 +1,94 @@
+import numpy as np
+from sklearn.feature_selection import f_regression
+from feature_stats import abs_correlation_matrix
+
+
+# Index of the best value, picked like the original `best == None or value > best` loop:
+# the first entry is taken as is (even when NaN), later NaN entries never win, and ties keep the first
+def first_argmax(values):
+    if np.isnan(values[0]):
+        return 0
+    return int(np.nanargmax(values))
+
+
+# Incremental mRMR ranking
+# The relevance vector (F-test) and feature-feature correlation matrix are computed once,
+# and the relevance / redundancy of every candidate set is updated as features are added.
+# Gives the same objective as DataPreprocessor.compute_relevance_redundancy:
+#   rel(S) = mean(F[S]) / max(F[S])
+#   red(S) = mean(|corr(S x S)|)
+class MRMR(object):
+    def __init__(self, X, Y):
+        self.features = list(X.columns)
+        y = np.asarray(Y).reshape(len(Y), -1)[:, 0]
+        self.f_scores = f_regression(X, y)[0]
+        self.correlations = abs_correlation_matrix(X)
+
+
+    # Greedily orders up to k features
+    # When additive is true, we perform FCD mRMR, when false we perform FCQ mRMR
+    # Returns: List of selected feature names
+    def rank(self, k=10, additive=True, verbose=1):
+        if k < 1:
+            return []
+
+        f_scores = self.f_scores
+        corr = self.correlations
+        diag = np.diagonal(corr)
+
+        # Select first feature based on maximum relevance
+        first = first_argmax(f_scores)
+        selected = [first]
+        remaining = np.ones(len(self.features), dtype=bool)
+        remaining[first] = False
+
+        # Running sums for the selected set
+        f_sum = f_scores[first]
+        f_max = f_scores[first]
+        red_sum = diag[first]
+        red_cols = corr[first, :].copy()
+
+        for i in range(k-1):
+            candidates = np.flatnonzero(remaining)
+            if len(candidates) < 1:
+                break
+
+            if (verbose == 2):
+                print (" ---  Start iter ", i+1, " --- ")
+
+            # Objective for every candidate set S + {c} at once
+            s = len(selected) + 1
+            rel = (f_sum + f_scores[candidates]) / np.maximum(f_max, f_scores[candidates]) / s
+            red = (red_sum + 2 * red_cols[candidates] + diag[candidates]) / (s * s)
+            if (additive):
+                values = rel - red
+            else:
+                values = rel / red
+
+            if (verbose == 2):
+                for j, c in enumerate(candidates):
+                    print ("   Feature ", self.features[c], ":")
+                    print ("     rel = ", rel[j])
+                    print ("     red = ", red[j])
+                    print ("     value = ", values[j], "\n")
+
+            best = first_argmax(values)
+            best_col = candidates[best]
+
+            # Add the feature to selected features and update running sums
+            selected.append(best_col)
+            remaining[best_col] = False
+            f_sum += f_scores[best_col]
+            f_max = max(f_max, f_scores[best_col])
+            red_sum += 2 * red_cols[best_col] + diag[best_col]
+            red_cols += corr[best_col, :]
+
+            if (verbose):
+                print("Iter ", i+1, " added feature ", self.features[best_col], " for an overall value of ", values[best])
+
+        selected_features = [self.features[c] for c in selected]
+        if (verbose):
+            print ("mRMR selected features:\n", selected_features)
+
+        return selected_features
+
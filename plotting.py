@@ -3,9 +3,10 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib
 import seaborn as sn
-from scipy.stats import pearsonr
+from feature_stats import pearson_correlations
 from matplotlib.lines import Line2D
 import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 featureTypes = {
     'bedrooms'      : 'ordinal',
@@ -36,6 +37,80 @@ typeEnum = {
     'continuous'    : 3
 }
 
+
+# Renders plots in background processes so training / scoring never waits on matplotlib
+# At most max_pending plots are queued at once (submit blocks until one finishes when the queue is full)
+# n_workers=0 renders inline, and enabled=False drops every plot
+class PlotQueue(object):
+    def __init__(self, n_workers=2, max_pending=32, enabled=True):
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self.executor = None
+        self.pending = set()
+
+    # Queues a call to a plotting function
+    def submit(self, plot_fn, *args, **kwargs):
+        if not self.enabled:
+            return
+        if self.n_workers == 0:
+            plot_fn(*args, **kwargs)
+            return
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.n_workers)
+
+        while len(self.pending) >= self.max_pending:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+        self.pending.add(self.executor.submit(plot_fn, *args, **kwargs))
+
+    # Waits for all outstanding plots (re-raises any error from a plot)
+    def flush(self):
+        done, _ = wait(self.pending)
+        self.pending = set()
+        for future in done:
+            future.result()
+
+    # Flushes and shuts down the worker processes
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+# Lat / long bounds of the map background: [lat_min, long_min, lat_max, long_max]
+map_bounds = [47.0451, -122.5736, 47.8116, -120.9609]
+
+# Decoded map backgrounds, keyed by (path, modification time)
+map_background_cache = {}
+
+
+# Gets the decoded map background, reading the image file only the first time
+def get_map_background(background_dir='./map.png'):
+    key = (background_dir, os.path.getmtime(background_dir))
+    if key not in map_background_cache:
+        map_background_cache[key] = plt.imread(background_dir)
+    return map_background_cache[key]
+
+
+# Projects long / lat onto the [0, 1] x [0, 1] map canvas with whole-array arithmetic
+def project_latlong(long, lat, bounds=map_bounds):
+    x = (np.asarray(long, dtype=np.float64) - bounds[1]) / (bounds[3] - bounds[1])
+    y = (np.asarray(lat, dtype=np.float64) - bounds[0]) / (bounds[2] - bounds[0])
+    return x, y
+
+
+# Creates a figure with the (cached) map background drawn on the [0, 1] x [0, 1] canvas
+def map_canvas(background_dir='./map.png'):
+    fig, ax = plt.subplots()
+    ax.imshow(get_map_background(background_dir), extent=[0, 1, 0, 1])
+    return fig, ax
+
+
 # Plots histograms of all features in input dataframe
 def plot_feature_histograms(X, feature_stats=None, save_dir='./figures'):
     os.makedirs(save_dir, exist_ok=True)
@@ -64,13 +139,14 @@ def plot_feature_histograms(X, feature_stats=None, save_dir='./figures'):
 
 # Plots feature correlation with the label
 def plot_feature_correlation(X, Y, save_dir):
-    for column in X.columns:
+    correlations = pearson_correlations(X, Y[Y.columns[0]])
+    for i, column in enumerate(X.columns):
         plt.scatter(x=X[column], y=Y[Y.columns[0]])
         plt.title('%s Feature Correlation (%s)' % (column, featureTypes[column]))
         plt.ylabel('Price')
         plt.xlabel('%s' % column)
 
-        xy_correlation = pearsonr(X[column], Y[Y.columns[0]])[0]
+        xy_correlation = correlations[i]
 
         # Displaying 
         props = dict(boxstyle='round', facecolor='wheat', alpha=0.5) #From Stackoverflow
@@ -89,19 +165,14 @@ def plot_latlong_clusters(X, Y, cluster, save_dir, background_dir="./map.png", s
         return
 
     # Transform lat and long with map offset
-    mc = [47.0451, -122.5736, 47.8116, -120.9609]
-    y = Y.apply(lambda x: (x - mc[0]) / (mc[2] - mc[0]))
-    x = X.apply(lambda x: (x - mc[1]) / (mc[3] - mc[1]))
+    x, y = project_latlong(X, Y)
 
     # Gets color map for clusters from colormap (to allow any # of clusters)
     cmap = plt.cm.ScalarMappable(norm=matplotlib.colors.Normalize(vmin=np.min(clusters), vmax=np.max(clusters)), cmap='jet')
 
     # Create and save plot
-    bg = plt.imread(background_dir)
-    fig, ax = plt.subplots()
-    ax.imshow(bg, extent=[0, 1, 0, 1])
-    for clust in clusters:
-        ax.scatter(x[cluster == clust], y[cluster == clust], color=cmap.to_rgba(clust), s=marker_size)
+    fig, ax = map_canvas(background_dir)
+    ax.scatter(x, y, color=cmap.to_rgba(np.asarray(cluster)), s=marker_size)
     ax.axis('off')
     plt.savefig('%s/%s.png' % (save_dir, save_name), dpi=300)
     plt.clf()
@@ -135,19 +206,14 @@ def plot_eps_neighbor_search(k_nearest_distances, optimal_eps, save_dir):
 
 def plot_train_test_split(long_train, long_test, lat_train, lat_test, save_dir='./figures', background_dir='./map.png', marker_size=0.03, k=-1):
     # Transform lat and long with map offset
-    mc = [47.0451, -122.5736, 47.8116, -120.9609]
-    long_tr = long_train.apply(lambda x: (x - mc[1]) / (mc[3] - mc[1]))
-    long_te  = long_test.apply(lambda x: (x - mc[1]) / (mc[3] - mc[1]))
-    lat_tr  = lat_train.apply(lambda x: (x - mc[0]) / (mc[2] - mc[0]))
-    lat_te   = lat_test.apply(lambda x: (x - mc[0]) / (mc[2] - mc[0]))
+    long_tr, lat_tr = project_latlong(long_train, lat_train)
+    long_te, lat_te = project_latlong(long_test, lat_test)
 
     # Gets color map for clusters from colormap (to allow any # of clusters)
     cmap = plt.cm.ScalarMappable(norm=matplotlib.colors.Normalize(vmin=0, vmax=1), cmap='bwr')
 
     # Create and save plot
-    bg = plt.imread(background_dir)
-    fig, ax = plt.subplots()
-    ax.imshow(bg, extent=[0, 1, 0, 1])
+    fig, ax = map_canvas(background_dir)
     ax.scatter(long_te, lat_te, color=cmap.to_rgba(1), s=marker_size, label='Test')
     ax.scatter(long_tr, lat_tr, color=cmap.to_rgba(0), s=marker_size, label='Train')
     ax.axis('off')
@@ -167,9 +233,11 @@ def plot_train_test_split(long_train, long_test, lat_train, lat_test, save_dir='
     plt.close('all')
 
 
-def plot_kmeans_sse(sse_vals, save_dir='./figures/kmeans'):
+def plot_kmeans_sse(sse_vals, save_dir='./figures/kmeans', krange=None):
     os.makedirs(save_dir, exist_ok=True)
     x = np.linspace(1, len(sse_vals), len(sse_vals), endpoint=True)
+    if krange is not None:
+        x = np.asarray(list(krange))
 
     plt.plot(x, sse_vals)
     plt.xticks(x[::2])
@@ -204,18 +272,14 @@ def plot_pearson_matrix(X_train, Y_train, label='price', save_dir='./figures/cor
 def plot_price_heatmap(long, lat, prices,
 save_dir='./figures', background_dir='./map.png', marker_size=0.03, k=-1):
     # Transform lat and long with map offset
-    mc = [47.0451, -122.5736, 47.8116, -120.9609]
-    long_temp = long.apply(lambda x: (x - mc[1]) / (mc[3] - mc[1]))
-    lat_temp  = lat.apply(lambda x: (x - mc[0]) / (mc[2] - mc[0]))
+    long_temp, lat_temp = project_latlong(long, lat)
 
     # Gets color map for clusters from colormap (to allow any # of clusters)
     cmap = plt.cm.ScalarMappable(norm=matplotlib.colors.Normalize(
         vmin=np.min(prices), vmax=np.max(prices)), cmap='summer')
 
     # Create and save plot
-    bg = plt.imread(background_dir)
-    fig, ax = plt.subplots()
-    ax.imshow(bg, extent=[0, 1, 0, 1])
+    fig, ax = map_canvas(background_dir)
     ax.scatter(long_temp, lat_temp, color=cmap.to_rgba(prices), s=marker_size, label='Test')
     cbar = fig.colorbar(cmap)
     cbar.set_label('Price (USD)')
@@ -0,0 +1,52 @@
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler, PolynomialFeatures, StandardScaler
+
+
+# Polynomial expansion of the selected features, computed once per fold and shared by every cluster
+# Features are min-max scaled on the fold's train rows before expanding (keeps high powers well conditioned).
+# Since min-max scaling is affine, the expanded columns span the same space as expanding each cluster's
+# own normalized features, so per-cluster linear fits on them give the same predictions.
+class FoldPolynomialFeatures(object):
+    def __init__(self, features, degree=2, dtype=np.float64):
+        self.features = list(features)
+        self.degree = degree
+        self.dtype = dtype
+
+    def fit(self, X_train):
+        values = np.asarray(X_train[self.features], dtype=np.float64)
+        self.scaler = MinMaxScaler().fit(values)
+        self.poly = PolynomialFeatures(degree=self.degree, interaction_only=False, include_bias=False)
+        self.poly.fit(values)
+        return self
+
+    # Expands raw rows (DataFrame with at least the selected features)
+    def transform(self, X):
+        values = self.scaler.transform(np.asarray(X[self.features], dtype=np.float64))
+        return self.poly.transform(values).astype(self.dtype, copy=False)
+
+    # Mask of the expanded columns that only use the given features
+    # (drops the terms of features that are constant within a cluster)
+    def get_support(self, features):
+        unused = np.array([feature not in features for feature in self.features])
+        return ~np.any(self.poly.powers_[:, unused] > 0, axis=1)
+
+
+# Per-cluster view of a FoldPolynomialFeatures expansion: column subset plus a StandardScaler
+# fitted on the cluster's train rows (reused as-is for the test rows and for new listings)
+class ClusterPolyTransform(object):
+    def __init__(self, expansion, features):
+        self.expansion = expansion
+        self.support = expansion.get_support(features)
+        self.scaler = StandardScaler(with_std=True)
+
+    # Fits the scaler on the cluster's rows of the already expanded fold train matrix
+    def fit_transform_rows(self, expanded, rows):
+        return self.scaler.fit_transform(expanded[np.ix_(rows, self.support)])
+
+    # Scales the cluster's rows of an already expanded matrix
+    def transform_rows(self, expanded, rows):
+        return self.scaler.transform(expanded[np.ix_(rows, self.support)])
+
+    # Transforms raw rows (DataFrame with the original feature columns)
+    def transform(self, X):
+        return self.scaler.transform(self.expansion.transform(X)[:, self.support])
@@ -1,14 +1,19 @@
 import numpy as np
 import pandas as pd
 from sklearn import preprocessing
-import statistics
 from sklearn.model_selection import train_test_split, KFold
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.feature_selection import f_regression
-from scipy.stats import pearsonr
 from plotting import *
+from mrmr import *
+from feature_stats import *
+from scoring import transform_rows
+from data_cache import load_house_data
+from feature_ranking import rank_features, cut_ranking, get_fold_hash
+from knn_sweep import knn_prefix_sweep
 import os
+from functools import cached_property
 
 from scipy.stats import PearsonRConstantInputWarning
 
@@ -17,7 +22,7 @@ from scipy.stats import PearsonRConstantInputWarning
 class DataPreprocessor(object):
     def __init__(self, input_path=None, label='price', drop_features=['date'], save_dir=None, test_size=0.2,\
     normalize_features=True, omit_norm_features=['zipcode'], normalize_labels=False, save_plots=False, plotDir='./figures',
-    xtrain=None, xtest=None, ytrain=None, ytest=None, input_split=False):
+    xtrain=None, xtest=None, ytrain=None, ytest=None, input_split=False, export_data=False):
         self.input_path = input_path
         self.label = label
         self.drop_features = drop_features
@@ -26,31 +31,32 @@ class DataPreprocessor(object):
         self.normalize_features = normalize_features
         self.normalize_labels = normalize_labels
         self.omit_norm_features = omit_norm_features
+        self.mrmr_engine = None
 
         # Splitting data into features/labels
         if input_path:
-            self.X = pd.read_csv(self.input_path)
+            self.X = load_house_data(self.input_path)
             self.Y = pd.DataFrame(self.X[self.label])
 
-        os.makedirs(plotDir, exist_ok=True)
-        os.makedirs(save_dir, exist_ok=True)
-
+        # Inputs are never modified in place (dropping / normalizing / reindexing all create new frames)
         self.input_split = input_split
         if input_split:
-            self.X_train = xtrain.copy()
-            self.X_test  = xtest.copy()
-            self.Y_train = ytrain.copy()
-            self.Y_test  = ytest.copy()
+            self.X_train = xtrain
+            self.X_test  = xtest
+            self.Y_train = ytrain
+            self.Y_test  = ytest
 
         self.__preprocess_data()
 
+        # Exporting normalized data to CSV (opt-in, see export())
+        if (export_data):
+            self.export()
+
         if (save_plots):
+            os.makedirs(plotDir, exist_ok=True)
             plot_train_test_split(self.X_train['long'], self.X_test['long'], 
                 self.X_train['lat'], self.X_test['lat'])
 
-        self.get_feature_stats()
-        self.get_correlations()
-
         # Plots histograms
         if (save_plots):
             os.makedirs(plotDir+'/histograms', exist_ok=True)
@@ -79,17 +85,35 @@ class DataPreprocessor(object):
         self.X_train[omit] = omit_features_train
         self.X_test  = pd.DataFrame(mmScaler.transform(self.X_test[norm_features]), index=self.X_test.index, columns=norm_features)
         self.X_test[omit] = omit_features_test
+        self.feature_scaler = mmScaler
 
         # Normalizing labels as well
         if (normalize_labels):
+            mmScaler = preprocessing.MinMaxScaler()
             mmScaler.fit(self.Y_train)
             self.Y_train = pd.DataFrame(mmScaler.transform(self.Y_train), index=self.X_train.index, columns=[self.Y_train.columns[0]])
             self.Y_test  = pd.DataFrame(mmScaler.transform(self.Y_test), index=self.X_test.index, columns=[self.Y_test.columns[0]])
+            self.label_scaler = mmScaler
 
 
         return self.X_train, self.X_test, self.Y_train, self.Y_test
 
 
+    # Everything transform() needs to apply the fitted preprocessing to new rows (no data)
+    def get_transform_state(self):
+        return {
+            'drop_features'      : self.drop_features,
+            'normalize_features' : self.normalize_features,
+            'omit_norm_features' : self.omit_norm_features,
+            'norm_features'      : getattr(self, 'norm_features', None),
+            'feature_scaler'     : getattr(self, 'feature_scaler', None)
+        }
+
+    # Applies the feature preprocessing fitted on X_train (dropped features, normalization) to new rows
+    def transform(self, X):
+        return transform_rows(self.get_transform_state(), X)
+
+
     # Preprocesses data by normalizing, dropping specified features, and splitting into train/test sets
     # TODO: Incorporate splitting from decision tree (GINI/Entropy) to bin data as well (if needed)
     def __preprocess_data(self):
@@ -114,39 +138,43 @@ class DataPreprocessor(object):
         if self.normalize_features:
             self.normalize_data(self.normalize_labels, self.omit_norm_features)
 
-        self.X_train.reset_index(inplace=True, drop=True)
-        self.X_test.reset_index(inplace=True, drop=True)
-        self.Y_train.reset_index(inplace=True, drop=True)
-        self.Y_test.reset_index(inplace=True, drop=True) 
+        # Fold row indices are kept to identify the fold in the rf_rank cache
+        self.train_index = self.X_train.index
+        self.X_train = self.X_train.reset_index(drop=True)
+        self.X_test  = self.X_test.reset_index(drop=True)
+        self.Y_train = self.Y_train.reset_index(drop=True)
+        self.Y_test  = self.Y_test.reset_index(drop=True)
 
-        
-        # Exporting normalized data to CSV
-        if (self.save_dir != None):    
-            self.X_train.to_csv('%s/X_train.csv' % (self.save_dir))
-            self.Y_train.to_csv('%s/Y_train.csv' % (self.save_dir))
+        return self.X_train, self.X_test, self.Y_train, self.Y_test
 
-            self.X_test.to_csv('%s/X_test.csv' % (self.save_dir))
-            self.Y_test.to_csv('%s/Y_test.csv' % (self.save_dir))
 
+    # Exports the preprocessed train / test sets to CSV in save_dir
+    def export(self, save_dir=None):
+        if save_dir is None:
+            save_dir = self.save_dir
+        os.makedirs(save_dir, exist_ok=True)
+
+        self.X_train.to_csv('%s/X_train.csv' % (save_dir))
+        self.Y_train.to_csv('%s/Y_train.csv' % (save_dir))
+
+        self.X_test.to_csv('%s/X_test.csv' % (save_dir))
+        self.Y_test.to_csv('%s/Y_test.csv' % (save_dir))
 
-        return self.X_train, self.X_test, self.Y_train, self.Y_test
 
+    # Feature stats and label correlations are computed the first time they are used, then cached
+    @cached_property
+    def feature_stats(self):
+        return self.get_feature_stats()
+
+    @cached_property
+    def feature_label_correlations(self):
+        return self.get_correlations()
 
     # Gets list of correlations, sorted in reverse order by magnitude of correlation for each feature within a dataframe
-    # TODO: Handle case for constant value arrays (i.e. cluster of houses in mainland all have waterfront == 0)
+    # (Constant value arrays, i.e. cluster of houses in mainland all have waterfront == 0, get a correlation of 1e-10)
     def get_correlations(self, disp=False):
-        correlations = []
-        for i, column in enumerate(self.X_train.columns):
-            corr = 0
-            if len(list(set(self.X_train[column]))) <= 1:
-                corr = 1e-10
-            else:
-                try:
-                    corr = pearsonr(self.X_train[column], self.Y_train[self.label])[0]
-                except RuntimeWarning:
-                    print('Runtime warning')
-
-            correlations.append((column, corr))
+        corr = pearson_correlations(self.X_train, self.Y_train[self.label])
+        correlations = list(zip(self.X_train.columns, corr))
 
         correlations = sorted(correlations, key=lambda tup: abs(tup[1]), reverse=True)
 
@@ -161,38 +189,22 @@ class DataPreprocessor(object):
 
     # Gets stats for each feature like mean, stddev, etc...
     def get_feature_stats(self):
-        stats = {}
-        for column in self.X_train.columns:
-            stats[column] = {}
-            stats[column]['mean'] = np.mean(self.X_train[column])
-            stats[column]['median'] = np.median(self.X_train[column])
-            stats[column]['std']  = np.std(self.X_train[column])
-            stats[column]['var']  = np.var(self.X_train[column])
-
-            # Gets mode (or None in case of continuous / equally probable values)
-            try:
-                stats[column]['mode'] = statistics.mode(self.X_train[column])
-            except statistics.StatisticsError:
-                mode = -1
+        stats = column_stats(self.X_train)
 
         self.feature_stats = stats
 
         return stats
 
     # Ranks the input features using a random forest algorithm (MSE)
-    def rf_rank(self, n_estimators=25, max_depth=None, disp=False, threshold=None):
-        rf = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth)
-        rf.fit(self.X_train, self.Y_train['price'])
-        feature_importances = zip(self.X_train.columns, rf.feature_importances_)
-        feature_importances = sorted(feature_importances, key=lambda tup: abs(tup[1]), reverse=True)
+    # n_jobs, subsample, max_samples, mode ('impurity' / 'permutation') and the other rank_args are passed to
+    # feature_ranking.rank_features, which caches the forest and importances of each fold
+    def rf_rank(self, n_estimators=25, max_depth=None, disp=False, threshold=None, **rank_args):
+        fold_hash = get_fold_hash(self.X_train, self.train_index, salt=str(self.normalize_features))
+        feature_importances = rank_features(self.X_train, self.Y_train['price'], n_estimators=n_estimators, max_depth=max_depth,
+            fold_hash=fold_hash, **rank_args)
 
         if threshold:
-            cutoff = len(feature_importances)
-            for i, importance in enumerate(feature_importances):
-                if importance[1] < threshold:
-                    cutoff = i
-                    break
-            feature_importances = feature_importances[:cutoff]
+            feature_importances = cut_ranking(feature_importances, threshold)
             feature_strs = []
             for i in range(len(feature_importances)):
                 feature_strs.append(feature_importances[i][0])
@@ -210,25 +222,10 @@ class DataPreprocessor(object):
     # MRMR
     ##################################################
     def compute_correlation(self, X, Y):
-        correlations = []
-        for i, column in enumerate(X.columns):
-            correlations.append(abs(get_correlation(X[column], Y[Y.columns[0]])))
-
-        return correlations
+        return list(np.abs(pearson_correlations(X, Y[Y.columns[0]])))
 
     def compute_self_correlation(self, X):
-        correlations = []
-        for i, i_column in enumerate(X.columns):
-            for j, j_column in enumerate(X.columns):
-                if (len(list(set(X[i_column]))) <= 1 or len(list(set(X[j_column]))) <= 1):
-                    correlations.append(1e-10)
-                else:
-                    try:
-                        correlations.append(abs(pearsonr(X[i_column], X[j_column])[0]))
-                    except RuntimeWarning:
-                        print('rt warning')
-
-        return correlations
+        return list(abs_correlation_matrix(X).ravel())
 
     def compute_f_statistic(self, X, Y):
         f_scores = []
@@ -265,79 +262,16 @@ class DataPreprocessor(object):
 
     # Perform mRMR to greedily select the top k features which minimize redundancy and maximize relevance
     # When additive is true, we perform FCD mRMR, when false we perform FCQ mRMR
+    # Relevance and feature correlations are computed once per preprocessor and reused between calls
     # Returns: List of selected feature names
     def mRMR(self, k=10, additive=True, verbose=1):
         if k < 1:
             return []
 
-        # Compute F-Test (used for relevance)
-        f_scores = f_regression(self.X_train, self.Y_train[self.Y_train.columns[0]])[0]
-        f_scores /= np.max(f_scores)
-
-        # Select first feature based on maximum relevance
-        best = None
-        best_col = None
-        for i, column in enumerate(self.X_train.columns):
-            if (best == None or f_scores[i] > best):
-                best = f_scores[i]
-                best_col = column
-
-        selected_features = [best_col]
-        remaining_features = self.X_train.columns.tolist()
-        remaining_features.remove(best_col)
-        overall = 0
-        rel, red = self.compute_relevance_redundancy(self.X_train[selected_features], self.Y_train)
-        if (additive):
-            overall = rel - red
-        else:
-            overall = rel / red
-
-        # Add up to k addition features, so long as overall objective function is improving
-        for i in range(k-1):
-            best = None
-            best_col = None
-
-            if (len(remaining_features) < 1):
-                break
-
-            if (verbose == 2):
-                print (" ---  Start iter ", i+1, " --- ")
-
-            # Try adding each feature and select one that maximizes the objective function
-            for j, col in enumerate(remaining_features):
-                features = selected_features.copy()
-                features.append(col)
-                try:
-                    rel, red = self.compute_relevance_redundancy(self.X_train[features], self.Y_train)
-
-                    value = 0
-                    if (additive):
-                        value = rel - red
-                    else:
-                        value = rel / red
-
-                    if (best == None or value > best):
-                        best = value
-                        best_col = col
-
-                    if (verbose == 2):
-                        print ("   Feature ", col, ":")
-                        print ("     rel = ", rel)
-                        print ("     red = ", red)
-                        print ("     value = ", value, "\n")
-                except RuntimeWarning:
-                    print('Runtime Warning')
-
-            # Add the feature to selected features and continue
-            selected_features.append(best_col)
-            remaining_features.remove(best_col)
-            overall = best
-
-            if (verbose):
-                print("Iter ", i+1, " added feature ", best_col, " for an overall value of ", overall)
-
-        if (verbose):
-            print ("mRMR selected features:\n", selected_features)
+        if self.mrmr_engine is None:
+            self.mrmr_engine = MRMR(self.X_train, self.Y_train)
+
+        selected_features = self.mrmr_engine.rank(k=k, additive=additive, verbose=verbose)
 
         self.mRMR_features = selected_features
         return selected_features
@@ -345,62 +279,36 @@ class DataPreprocessor(object):
 
     # Feature selection with mRMR for full dataset, using varying number of features
     # Seems to vary noticably between runs, probably want to do some kind of averaging
+    # Every prefix length of each mRMR ordering is scored from one blockwise distance pass (see knn_sweep.py)
     def mRMR_KNN_test(self):
-        feature_order = self.mRMR(k=len(self.X_train.columns), additive=True, verbose=0)
-        best = 0
-        best_features = []
         print(" --- Using FCD mRMR --- ")
-        for k in range(1, len(self.X_train.columns)):
-            features = feature_order[:k]
-            KNN = KNeighborsRegressor(n_neighbors=5, weights='distance')
-            KNN.fit(self.X_train[features], self.Y_train[self.label])
-            score = KNN.score(self.X_train[features], self.Y_train[self.label])
-            print("KNN using", k, "mRMR selected features. Score = ", score)
-
-            if score > best:
-                best = score
-                best_features = features
-        
-        print ("\b Best number of features for additive mRMR and KNN is ", len(best_features), " with score of", best, " and using features:\n", best_features)
+        self.mrmr_add_knn_best_features = self.__mRMR_KNN_sweep(additive=True)
+        print("\n --- Using FCDQ mRMR --- ")
+        self.mrmr_mult_knn_best_features = self.__mRMR_KNN_sweep(additive=False)
 
-        self.mrmr_add_knn_best_features = best_features
 
-        feature_order = self.mRMR(k=len(self.X_train.columns), additive=False, verbose=0)
+    # Scores KNN on the first k mRMR features for every k
+    # Returns: The best scoring feature prefix
+    def __mRMR_KNN_sweep(self, additive=True):
+        feature_order = self.mRMR(k=len(self.X_train.columns), additive=additive, verbose=0)
+        scores = knn_prefix_sweep(self.X_train, self.Y_train[self.label], feature_order, n_neighbors=5, weights='distance',
+            max_k=len(self.X_train.columns) - 1)
         best = 0
         best_features = []
-        print("\n --- Using FCDQ mRMR --- ")
-        for k in range(1, len(self.X_train.columns)):
-            features = feature_order[:k]
-            KNN = KNeighborsRegressor(n_neighbors=5, weights='distance')
-            KNN.fit(self.X_train[features], self.Y_train)
-            score = KNN.score(self.X_train[features], self.Y_train[self.label])
+        for k, score in enumerate(scores, start=1):
             print("KNN using", k, "mRMR selected features. Score = ", score)
 
             if score > best:
                 best = score
-                best_features = features
-        
-        print ("\b Best number of features for multiplicative mRMR and KNN is ", len(best_features), " with score of", best, " and using features:\n", best_features)
+                best_features = feature_order[:k]
 
-        self.mrmr_mult_knn_best_features = best_features
+        print ("\b Best number of features for %s mRMR and KNN is " % ('additive' if additive else 'multiplicative'),
+            len(best_features), " with score of", best, " and using features:\n", best_features)
+        return best_features
 
 
 
 
 # Gets stats for each feature like mean, stddev, etc...
 def get_feature_stats(X):
-    stats = {}
-    for column in X.columns:
-        stats[column] = {}
-        stats[column]['mean'] = np.mean(X[column])
-        stats[column]['median'] = np.median(X[column])
-        stats[column]['std']  = np.std(X[column])
-        stats[column]['var']  = np.var(X[column])
-
-        # Gets mode (or None in case of continuous / equally probable values)
-        try:
-            stats[column]['mode'] = statistics.mode(X[column])
-        except statistics.StatisticsError:
-            mode = -1
-
-    return stats
\ No newline at end of file
+    return column_stats(X)
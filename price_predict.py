@@ -16,14 +16,25 @@ import os
 from preprocess import *
 from plotting import *
 from cluster_model import * 
+from kfold import *
+from data_cache import load_house_data
+from tracing import Tracer, summarize_trace
 
 # Command-line Argument handler
 def handle_cl_args():
     # Default input variables
     savePlots = False
     plotDir = './figures'
-
-    opts, args = getopt.getopt(sys.argv[1:], 'hp', ['help', 'plot='])
+    foldJobs = 1
+    plotWorkers = 2
+    clusterPlots = True
+    splitDir = None
+    tune = False
+    earlyStopping = False
+    tracePath = None
+
+    opts, args = getopt.getopt(sys.argv[1:], 'hpj:', ['help', 'plot=', 'fold-jobs=', 'plot-workers=', 'no-cluster-plots', 'split-store=',
+        'tune', 'early-stopping', 'trace='])
     for opt, arg in opts:
         if opt in ('-h', '--help'):
             sys.exit(2)
@@ -31,17 +42,35 @@ def handle_cl_args():
             if (arg):
                 plotDir = arg
             savePlots = True
-
-    return (savePlots, plotDir)
+        elif opt in ('-j', '--fold-jobs'):
+            foldJobs = int(arg)
+        elif opt == '--plot-workers':
+            plotWorkers = int(arg)
+        elif opt == '--no-cluster-plots':
+            clusterPlots = False
+        elif opt == '--split-store':
+            splitDir = arg
+        elif opt == '--tune':
+            tune = True
+        elif opt == '--early-stopping':
+            earlyStopping = True
+        elif opt == '--trace':
+            tracePath = arg
+
+    return (savePlots, plotDir, foldJobs, plotWorkers, clusterPlots, splitDir, tune, earlyStopping, tracePath)
 
 
 if __name__ == '__main__':
-    savePlots, plotDir = handle_cl_args()
+    savePlots, plotDir, foldJobs, plotWorkers, clusterPlots, splitDir, tune, earlyStopping, tracePath = handle_cl_args()
+
 
+    # Stage timings go to a JSON-lines trace when a trace path is given (see tracing.py)
+    tracer = Tracer(tracePath)
 
     # KFold Split and Evaluation
     k = 5
-    X_0 = pd.read_csv('./data/kc_house_data.csv')
+    with tracer.span('load'):
+        X_0 = load_house_data('./data/kc_house_data.csv')
     Y_0 = pd.DataFrame(X_0['price'].copy(deep=True), columns=['price'])
     kf = KFold(n_splits=k)
 
@@ -66,53 +95,62 @@ if __name__ == '__main__':
     regressors = ['knn', 'lr', 'pr2', 'adaboost', 'gradientboosting', 'randomforest', 'decisiontree', 'xgboost']
     regressor_names = ['KNN', 'LR', 'PR2', 'ADAB', 'GB', 'RF', 'DT', 'XGB']
     csv_names = ['KNN', 'Multiple Regression', 'Adaboost', 'Gradient Boosting', 'Random Forest', 'Decision Tree', 'XGBoost']
-    for k_iter, (train_inds, test_inds) in enumerate(kf.split(X_0)):
-        print('Processing split %d' % (k_iter+1))
-        X_train, X_test = X_0.iloc[train_inds].copy(), X_0.iloc[test_inds].copy()
-        Y_train, Y_test = Y_0.iloc[train_inds].copy(), Y_0.iloc[test_inds].copy()
-
-        if k_iter == 0:
-            plot_pearson_matrix(X_train, Y_train, k=k_iter+1)
-
-        # Creating one specific type of cluster model
-        print('Initializing clustering model...')
-
-        if fsmode == 'mrmr':
-            cm = cluster_model(X_0, Y_0, X_train, X_test, Y_train, Y_test, cluster_type='latlong',\
-            cluster_methods=methods, regressors=regressors, plot_clusters=False, doMRMR=True)
-        elif fsmode == 'rf':
-            cm = cluster_model(X_0, Y_0, X_train, X_test, Y_train, Y_test, cluster_type='latlong',\
-            cluster_methods=methods, regressors=regressors, plot_clusters=False, doRF=True)
-        else:
-            cm = cluster_model(X_0, Y_0, X_train, X_test, Y_train, Y_test, cluster_type='latlong',\
-            cluster_methods=methods, regressors=regressors, plot_clusters=False)
-
-
-        if savePlots:
-            plot_train_test_split(X_train['long'], X_test['long'], X_train['lat'], X_test['lat'], k=k_iter+1)
-
-        cm.evaluate()
-
+    if fsmode == 'mrmr':
+        model_args = {'doMRMR' : True}
+    elif fsmode == 'rf':
+        model_args = {'doRF' : True}
+    else:
+        model_args = {}
+    model_args.update({'cluster_type' : 'latlong', 'cluster_methods' : methods, 'regressors' : regressors, 'plot_clusters' : False,
+        'cluster_plots' : clusterPlots, 'tune_regressors' : tune,
+        'early_stopping' : earlyStopping, 'tracer' : tracer})
+
+    # Preprocessed cluster splits of every fold are kept as .npy files when a split store directory is given
+    if splitDir:
+        model_args['split_store'] = NpySplitStore(splitDir)
+
+    # Folds run in foldJobs worker processes, all reading the same memory-mapped copy of the dataset
+    dataset = SharedDataset(X_0, Y_0)
+    try:
+        fold_scores = run_folds(dataset, kf.split(X_0), model_args, n_jobs=foldJobs, savePlots=savePlots, plot_workers=plotWorkers)
+    finally:
+        dataset.cleanup()
+
+    if tracePath:
+        tracer.close()
+        print(summarize_trace(tracePath, run_id=tracer.run_id).to_string(float_format='%.3f'))
+
+    # Writing the tuned hyperparameters of every fold / cluster to CSV
+    if tune:
+        tuned_out = pd.DataFrame([{'Fold' : k_iter+1, 'Method' : method, 'Cluster' : cluster, 'Regressor' : regressor, 'Params' : params}
+            for k_iter, scores in enumerate(fold_scores) for (method, cluster, regressor), params in scores['tuned_params'].items()])
+        tuned_out.to_csv('./data/tuned_params_%s.csv' % (fsmode), index=False)
+
+    # Writing the stopping round and fit time of every boosted fold / cluster to CSV
+    if earlyStopping:
+        rounds_out = pd.DataFrame([{'Fold' : k_iter+1, 'Method' : method, 'Cluster' : cluster, 'Regressor' : regressor,
+            'Rounds' : n_rounds, 'Fit time (s)' : scores['fit_times'][(method, cluster, regressor)]}
+            for k_iter, scores in enumerate(fold_scores) for (method, cluster, regressor), n_rounds in scores['stopping_rounds'].items()])
+        rounds_out.to_csv('./data/stopping_rounds_%s.csv' % (fsmode), index=False)
+
+    for k_iter, scores in enumerate(fold_scores):
         # Mean evaluation scores
-        for method in cm.cluster_methods:
+        for method in methods:
             if method not in mean_r2_score.keys():
                 mean_r2_score[method] = {}
                 mean_rmse[method] = {}
                 r2_scores[method] = {}
                 rmse_scores[method] = {}
-            for regressor in cm.regressors:
+            for regressor in regressors:
                 if regressor not in mean_r2_score[method].keys():
                     mean_r2_score[method][regressor] = 0
                     mean_rmse[method][regressor] = 0
                     r2_scores[method][regressor] = []
                     rmse_scores[method][regressor] = []
-                mean_r2_score[method][regressor] += cm.r2_score[method][regressor]
-                mean_rmse[method][regressor] += cm.rmse[method][regressor]
-                r2_scores[method][regressor].append(cm.r2_score[method][regressor])
-                rmse_scores[method][regressor].append(cm.rmse[method][regressor])
-
-                plot_predictions(cm.predictions[method][regressor], cm.labels[method][regressor], 
-                cm.r2_score[method][regressor], cm.rmse[method][regressor], save_dir='./figures/'+method+'/'+regressor+'/'+str(k_iter+1))
+                mean_r2_score[method][regressor] += scores['r2_score'][method][regressor]
+                mean_rmse[method][regressor] += scores['rmse'][method][regressor]
+                r2_scores[method][regressor].append(scores['r2_score'][method][regressor])
+                rmse_scores[method][regressor].append(scores['rmse'][method][regressor])
 
 
 
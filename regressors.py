@@ -0,0 +1,233 @@
+import os
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestRegressor, AdaBoostRegressor, GradientBoostingRegressor
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import ParameterGrid
+from sklearn.metrics import mean_squared_error
+import xgboost
+from tracing import null_tracer
+
+
+# Rough relative cost of fitting each regressor on the same number of rows
+# (used to schedule the most expensive fits first)
+regressor_costs = {
+    'knn'              : 1,
+    'lr'               : 1,
+    'pr2'              : 2,
+    'pr3'              : 8,
+    'decisiontree'     : 4,
+    'adaboost'         : 40,
+    'gradientboosting' : 150,
+    'xgboost'          : 150,
+    'randomforest'     : 200
+}
+
+# Regressors that can use more than one thread internally
+threaded_regressors = ['knn', 'randomforest', 'xgboost']
+
+# Candidate hyperparameters for the successive halving search (lr / pr2 / pr3 have nothing to tune)
+param_grids = {
+    'knn'              : {'n_neighbors' : [3, 5, 10, 20], 'weights' : ['uniform', 'distance']},
+    'decisiontree'     : {'max_depth' : [None, 6, 10, 16], 'min_samples_leaf' : [1, 5, 20]},
+    'adaboost'         : {'learning_rate' : [0.05, 0.2, 0.5, 1.0], 'loss' : ['linear', 'square', 'exponential']},
+    'gradientboosting' : {'learning_rate' : [0.05, 0.1, 0.2], 'max_depth' : [3, 5, 7], 'subsample' : [0.8, 1.0]},
+    'randomforest'     : {'max_features' : [1.0, 0.5, 0.33], 'min_samples_leaf' : [1, 3, 10]},
+    'xgboost'          : {'learning_rate' : [0.03, 0.05, 0.1], 'max_depth' : [3, 5, 7], 'subsample' : [0.8, 1.0]}
+}
+
+# Ensembles are searched on a budget of estimators, everything else on a budget of training rows
+estimator_budget_regressors = ['adaboost', 'gradientboosting', 'randomforest', 'xgboost']
+
+# Boosting regressors that can stop adding rounds once held-out rows stop improving
+early_stopping_regressors = ['gradientboosting', 'xgboost']
+
+
+# Creates an unfitted regressor with the configuration used by cluster_model
+# n_threads is the inner thread budget for regressors that support it, params overrides the configuration
+def build_regressor(regressor, n_threads=1, random_state=None, params=None):
+    model = get_default_regressor(regressor, n_threads, random_state)
+    if model is not None and params:
+        model.set_params(**params)
+    return model
+
+
+# The hand-picked configuration of each regressor (the starting point of the tuning search)
+def get_default_regressor(regressor, n_threads=1, random_state=None):
+    if regressor == 'knn':
+        return KNeighborsRegressor(n_neighbors=5, weights='distance', n_jobs=n_threads)
+    elif regressor in ('lr', 'pr2', 'pr3'):
+        return LinearRegression(normalize=True)
+    elif regressor == 'adaboost':
+        return AdaBoostRegressor(n_estimators=100, learning_rate=0.2, loss='exponential', random_state=random_state)
+    elif regressor == 'gradientboosting':
+        return GradientBoostingRegressor(n_estimators=400, learning_rate=0.1, loss='ls', max_depth=5, min_samples_split=2,
+            random_state=random_state)
+    elif regressor == 'randomforest':
+        return RandomForestRegressor(n_estimators=400, n_jobs=n_threads, random_state=random_state)
+    elif regressor == 'decisiontree':
+        return DecisionTreeRegressor(random_state=random_state)
+    elif regressor == 'xgboost':
+        return xgboost.XGBRegressor(n_estimators=900, learning_rate=0.05, max_depth=5, tree_method='hist', n_jobs=n_threads,
+            random_state=random_state)
+
+    return None
+
+
+# Rows of a DataFrame / Series or an array
+def take_rows(X, rows):
+    return X.iloc[rows] if hasattr(X, 'iloc') else X[rows]
+
+
+# Successive halving search over param_grids[regressor] on one cluster's training rows
+# A val_fraction of the rows is held out for scoring. Every candidate is first fitted on a small budget
+# (rows, or estimators for the ensembles), then only the best 1 / factor of them are refitted on factor times
+# the budget, until the last round uses the full budget.
+# Returns: (best params, list of {'round', 'resource', 'params', 'rmse'}); params is None when there is nothing to tune
+def successive_halving(regressor, X_train, Y_train, factor=3, val_fraction=0.2, min_rows=50, n_threads=1,
+    random_state=None):
+    if regressor not in param_grids or len(X_train) < 2 * min_rows:
+        return None, []
+
+    rng = np.random.RandomState(random_state)
+    rows = rng.permutation(len(X_train))
+    n_val = max(1, int(len(rows) * val_fraction))
+    val_rows, fit_rows = rows[:n_val], rows[n_val:]
+    X_val, Y_val = take_rows(X_train, val_rows), take_rows(Y_train, val_rows)
+
+    candidates = list(ParameterGrid(param_grids[regressor]))
+    n_rounds = max(1, int(np.ceil(np.log(len(candidates)) / np.log(factor))))
+    if regressor in estimator_budget_regressors:
+        max_resource = get_default_regressor(regressor).get_params()['n_estimators']
+        min_resource = 1
+    else:
+        max_resource = len(fit_rows)
+        min_resource = min_rows
+
+    history = []
+    for i in range(n_rounds):
+        resource = max(min_resource, int(max_resource / factor ** (n_rounds - 1 - i)))
+        scores = []
+        for params in candidates:
+            if regressor in estimator_budget_regressors:
+                model = build_regressor(regressor, n_threads, random_state, dict(params, n_estimators=resource))
+                model.fit(take_rows(X_train, fit_rows), take_rows(Y_train, fit_rows))
+            else:
+                sample = fit_rows[:resource]
+                if regressor == 'knn' and params['n_neighbors'] > len(sample):
+                    scores.append(np.inf)
+                    continue
+                model = build_regressor(regressor, n_threads, random_state, params)
+                model.fit(take_rows(X_train, sample), take_rows(Y_train, sample))
+
+            rmse = np.sqrt(mean_squared_error(Y_val, model.predict(X_val)))
+            scores.append(rmse)
+            history.append({'round' : i, 'resource' : resource, 'params' : params, 'rmse' : rmse})
+
+        # Promoting the best candidates (ties keep the grid order)
+        n_keep = max(1, int(np.ceil(len(candidates) / factor))) if i < n_rounds - 1 else 1
+        order = np.argsort(scores, kind='stable')[:n_keep]
+        candidates = [candidates[j] for j in order]
+
+    return candidates[0], history
+
+
+# Fits a gradientboosting / xgboost regressor that stops once the error on held-out rows plateaus
+# (no improvement for patience rounds). gradientboosting holds out its own val_fraction of the rows
+# (n_iter_no_change), xgboost is given a random val_fraction of them as its eval_set.
+# Clusters with fewer than min_rows rows are too small to hold rows out, and are fitted with every round.
+# Returns: (fitted model, number of boosting rounds kept)
+def fit_early_stopping(model, regressor, X_train, Y_train, patience=20, val_fraction=0.1, min_rows=50,
+    random_state=None):
+    if len(X_train) < min_rows:
+        model.fit(X_train, Y_train)
+        return model, model.get_params()['n_estimators']
+
+    if regressor == 'gradientboosting':
+        model.set_params(n_iter_no_change=patience, validation_fraction=val_fraction)
+        model.fit(X_train, Y_train)
+        return model, model.n_estimators_
+
+    rng = np.random.RandomState(random_state)
+    rows = rng.permutation(len(X_train))
+    n_val = max(1, int(len(rows) * val_fraction))
+    val_rows, fit_rows = rows[:n_val], rows[n_val:]
+    eval_set = [(take_rows(X_train, val_rows), take_rows(Y_train, val_rows))]
+
+    # Newer xgboost versions take early_stopping_rounds in the constructor, older ones in fit
+    if 'early_stopping_rounds' in model.get_params().keys():
+        model.set_params(early_stopping_rounds=patience)
+        model.fit(take_rows(X_train, fit_rows), take_rows(Y_train, fit_rows), eval_set=eval_set, verbose=False)
+    else:
+        model.fit(take_rows(X_train, fit_rows), take_rows(Y_train, fit_rows), eval_set=eval_set,
+            early_stopping_rounds=patience, verbose=False)
+    return model, model.best_iteration + 1
+
+
+# Fits a single (method, cluster, regressor) job
+# With tune=True the hyperparameters are first picked by successive_halving (tuning_args are passed to it)
+# With early_stopping=True the boosting regressors are fitted by fit_early_stopping (early_stopping_args are passed to it)
+# The fit is recorded as a 'fit' span of tracer (see tracing.Tracer)
+# Returns: (method, cluster, regressor, fitted model, wall time in seconds, info)
+# info has the tuned 'params', the 'search' history and the 'search_time' when tuning,
+# and the boosting rounds kept ('n_rounds') when stopping early
+def fit_regressor_job(method, cluster, regressor, X_train, Y_train, n_threads=1, random_state=None, tune=False,
+    tuning_args=None, early_stopping=False, early_stopping_args=None, tracer=null_tracer, fold=None):
+    with tracer.span('fit', n_rows=len(X_train), fold=fold, method=method, cluster=cluster, regressor=regressor,
+        n_threads=n_threads):
+        return fit_regressor(method, cluster, regressor, X_train, Y_train, n_threads, random_state, tune, tuning_args,
+            early_stopping, early_stopping_args)
+
+
+def fit_regressor(method, cluster, regressor, X_train, Y_train, n_threads=1, random_state=None, tune=False,
+    tuning_args=None, early_stopping=False, early_stopping_args=None):
+    start = time.perf_counter()
+    info = {}
+    params = None
+    if tune:
+        params, info['search'] = successive_halving(regressor, X_train, Y_train, n_threads=n_threads,
+            random_state=random_state, **(tuning_args or {}))
+        info['params'] = params
+        info['search_time'] = time.perf_counter() - start
+
+    model = build_regressor(regressor, n_threads=n_threads, random_state=random_state, params=params)
+    if early_stopping and regressor in early_stopping_regressors:
+        model, info['n_rounds'] = fit_early_stopping(model, regressor, X_train, Y_train, random_state=random_state,
+            **(early_stopping_args or {}))
+    else:
+        model.fit(X_train, Y_train)
+    return method, cluster, regressor, model, time.perf_counter() - start, info
+
+
+# Fits a list of (method, cluster, regressor, X_train, Y_train) jobs on a pool of n_jobs workers
+# Jobs are started largest first, and the n_cores budget is split between the workers so the
+# inner n_jobs / nthread settings of each regressor don't oversubscribe the machine
+# Returns: List of fit_regressor_job results, in the order the jobs were scheduled
+def fit_regressor_jobs(jobs, n_jobs=1, n_cores=None, random_state=None, tune=False, tuning_args=None,
+    early_stopping=False, early_stopping_args=None, tracer=null_tracer, fold=None):
+    jobs = [job for job in jobs if job[2] in regressor_costs]
+    jobs = sorted(jobs, key=lambda job: len(job[3]) * regressor_costs[job[2]], reverse=True)
+    if len(jobs) == 0:
+        return []
+
+    if n_cores is None:
+        n_cores = os.cpu_count() or 1
+    # Negative n_jobs counts back from the core budget, as in joblib (-1 = one worker per core)
+    if n_jobs < 0:
+        n_jobs = n_cores + 1 + n_jobs
+    n_workers = max(1, min(n_jobs, len(jobs), n_cores))
+    n_threads = max(1, n_cores // n_workers)
+
+    if n_workers == 1:
+        return [fit_regressor_job(*job, n_threads=n_threads, random_state=random_state, tune=tune,
+            tuning_args=tuning_args, early_stopping=early_stopping, early_stopping_args=early_stopping_args,
+            tracer=tracer, fold=fold) for job in jobs]
+
+    return Parallel(n_jobs=n_workers)(
+        delayed(fit_regressor_job)(*job, n_threads=n_threads, random_state=random_state, tune=tune,
+            tuning_args=tuning_args, early_stopping=early_stopping, early_stopping_args=early_stopping_args,
+            tracer=tracer, fold=fold) for job in jobs
+    )
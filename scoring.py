@@ -0,0 +1,129 @@
+import os
+import numpy as np
+import pandas as pd
+import joblib
+
+
+# Lightweight scoring path for fitted cluster models
+# (only needs numpy, pandas and the fitted estimators, so a scoring process
+# doesn't import the training / plotting modules or read the training CSV)
+
+
+# Applies a preprocessor's fitted feature transform (see DataPreprocessor.get_transform_state) to new rows
+def transform_rows(state, X):
+    X = X.drop(state['drop_features'], axis=1, errors='ignore')
+    if not state['normalize_features']:
+        return X.copy()
+
+    norm_features = state['norm_features']
+    omit = state['omit_norm_features']
+    X_norm = pd.DataFrame(state['feature_scaler'].transform(X[norm_features]), index=X.index, columns=norm_features)
+    X_norm[omit] = X[omit]
+    return X_norm
+
+
+# Routes each row of X to its cluster for a clustering method, with one call to the cluster model
+def route_clusters(method_model, method, X):
+    if method == 'kmeans':
+        return np.asarray(method_model['model'].predict(X[['lat', 'long']]))
+    elif method == 'dbscan':
+        return np.asarray(method_model['predictor'].predict(X[['lat', 'long']]))
+
+    return np.zeros(len(X), dtype=int)
+
+
+# Predicts prices for a DataFrame of new listings with the clusters of one method
+# Rows are grouped by cluster so each regressor is called once per cluster
+# Returns: Array of predicted prices in the same order as the rows of X
+def predict_clusters(method_model, method, regressor, X):
+    labels = route_clusters(method_model, method, X)
+    predictions = np.zeros(len(X))
+
+    # Grouping rows into contiguous blocks of each cluster
+    order = np.argsort(labels, kind='stable')
+    clusters, starts = np.unique(labels[order], return_index=True)
+    for label, rows in zip(clusters, np.split(order, starts[1:])):
+        cluster = method_model[label]
+
+        # Poly regression expands the raw rows with the fold-wide expansion (see poly_features.py)
+        if regressor == 'pr2' or regressor == 'pr3':
+            X_cluster = cluster[regressor]['poly_transform'].transform(X.iloc[rows])
+        else:
+            X_cluster = transform_rows(cluster['transform_state'], X.iloc[rows])[cluster['features']]
+
+        predictions[rows] = cluster[regressor]['model'].predict(X_cluster)
+
+    return predictions
+
+
+# Keeps only what is needed for scoring from a fitted cluster_model
+# (no train / test frames or per-cluster DataPreprocessor objects)
+def get_artifact(cm):
+    models = {}
+    for method in cm.cluster_methods:
+        models[method] = {}
+        for key, entry in cm.models[method].items():
+            if key == 'model' or key == 'predictor':
+                models[method][key] = entry
+                continue
+
+            cluster = {'features' : entry['features'], 'transform_state' : entry['transform_state']}
+            for regressor in cm.regressors:
+                if regressor not in entry.keys():
+                    continue
+                cluster[regressor] = {}
+                for part in ('model', 'poly_transform'):
+                    if part in entry[regressor].keys():
+                        cluster[regressor][part] = entry[regressor][part]
+            models[method][key] = cluster
+
+    return {
+        'cluster_methods'   : list(cm.cluster_methods),
+        'regressors'        : list(cm.regressors),
+        'selected_features' : list(cm.selected_features),
+        'models'            : models
+    }
+
+
+# Saves a fitted cluster_model for scoring
+# The file is written uncompressed so large arrays (KNN points, tree nodes, ...) can be memory-mapped on load
+def save_model(cm, path):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    joblib.dump(get_artifact(cm), path)
+    return path
+
+
+# Copies the read-only (memory-mapped) arrays of an estimator into memory
+# KMeans.predict needs writable cluster_centers_, so the clustering models are not kept memory-mapped
+def make_writable(model):
+    for name, value in vars(model).items():
+        if isinstance(value, np.ndarray) and not value.flags.writeable:
+            setattr(model, name, np.array(value))
+    return model
+
+
+# Loads a model saved with save_model
+# With mmap_mode='r' the regressors' arrays stay on disk and are paged in as they are used
+# (the KMeans models are small and are copied into memory, see make_writable)
+def load_model(path, mmap_mode='r'):
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+    if mmap_mode is not None and 'kmeans' in artifact['models'].keys():
+        make_writable(artifact['models']['kmeans']['model'])
+    return ClusterScorer(artifact)
+
+
+# Scoring-only view of a fitted cluster_model
+class ClusterScorer(object):
+    def __init__(self, artifact):
+        self.cluster_methods = artifact['cluster_methods']
+        self.regressors = artifact['regressors']
+        self.selected_features = artifact['selected_features']
+        self.models = artifact['models']
+
+    def get_clusters(self, X, method):
+        return route_clusters(self.models[method], method, X)
+
+    def predict(self, X, method, regressor):
+        return predict_clusters(self.models[method], method, regressor, X)
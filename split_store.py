@@ -0,0 +1,91 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+# Stores for the preprocessed per-cluster train / test splits, keyed by (fold, method, cluster)
+# Every store has the same interface:
+#   save(fold, method, cluster, X_train, X_test, Y_train, Y_test)
+#   load(fold, method, cluster) -> (X_train, X_test, Y_train, Y_test)
+#   keys(fold=None)             -> list of (fold, method, cluster)
+#   load_fold(fold)             -> {(method, cluster): (X_train, X_test, Y_train, Y_test)}
+
+split_names = ['X_train', 'X_test', 'Y_train', 'Y_test']
+
+
+# Keeps the splits in memory (only visible to the process that built them)
+class MemorySplitStore(object):
+    def __init__(self):
+        self.splits = {}
+
+    def save(self, fold, method, cluster, X_train, X_test, Y_train, Y_test):
+        self.splits[(fold, method, cluster)] = (X_train, X_test, Y_train, Y_test)
+
+    def load(self, fold, method, cluster):
+        return self.splits[(fold, method, cluster)]
+
+    def keys(self, fold=None):
+        return [key for key in self.splits.keys() if fold is None or key[0] == fold]
+
+    def load_fold(self, fold):
+        return {(key[1], key[2]) : self.load(*key) for key in self.keys(fold)}
+
+
+# Writes each split as a raw .npy array (plus the column names) under root/fold_<fold>/<method>/<cluster>
+# Loading memory-maps the arrays, so any fold's cluster splits can be reopened without parsing
+class NpySplitStore(object):
+    def __init__(self, root='./data/splits', mmap_mode='r'):
+        self.root = root
+        self.mmap_mode = mmap_mode
+
+    def get_dir(self, fold, method, cluster):
+        return os.path.join(self.root, 'fold_%s' % (fold), str(method), str(cluster))
+
+    def save(self, fold, method, cluster, X_train, X_test, Y_train, Y_test):
+        split_dir = self.get_dir(fold, method, cluster)
+        os.makedirs(split_dir, exist_ok=True)
+
+        columns = {}
+        for name, split in zip(split_names, (X_train, X_test, Y_train, Y_test)):
+            np.save(os.path.join(split_dir, name + '.npy'), split.to_numpy())
+            columns[name] = [str(column) for column in split.columns]
+
+        with open(os.path.join(split_dir, 'columns.json'), 'w') as f:
+            json.dump(columns, f)
+
+    def load(self, fold, method, cluster):
+        split_dir = self.get_dir(fold, method, cluster)
+        with open(os.path.join(split_dir, 'columns.json')) as f:
+            columns = json.load(f)
+
+        splits = []
+        for name in split_names:
+            values = np.load(os.path.join(split_dir, name + '.npy'), mmap_mode=self.mmap_mode)
+            splits.append(pd.DataFrame(values, columns=columns[name], copy=False))
+        return tuple(splits)
+
+    # Cluster labels are returned as they appear in the directory names (strings)
+    def keys(self, fold=None):
+        keys = []
+        if not os.path.isdir(self.root):
+            return keys
+
+        for fold_dir in sorted(os.listdir(self.root)):
+            this_fold = fold_dir[len('fold_'):]
+            if fold is not None and this_fold != str(fold):
+                continue
+            for method in sorted(os.listdir(os.path.join(self.root, fold_dir))):
+                for cluster in sorted(os.listdir(os.path.join(self.root, fold_dir, method))):
+                    keys.append((this_fold, method, cluster))
+        return keys
+
+    def load_fold(self, fold):
+        return {(key[1], key[2]) : self.load(*key) for key in self.keys(fold)}
+
+
+# Exports one stored split to X_train.csv, Y_train.csv, X_test.csv and Y_test.csv in save_dir
+def export_split_csv(store, fold, method, cluster, save_dir):
+    os.makedirs(save_dir, exist_ok=True)
+    for name, split in zip(split_names, store.load(fold, method, cluster)):
+        split.to_csv('%s/%s.csv' % (save_dir, name))
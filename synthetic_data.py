@@ -0,0 +1,173 @@
+import os
+import sys
+import getopt
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+from scipy.stats import rankdata
+from sklearn.neighbors import KDTree
+from plotting import featureTypes
+from data_cache import load_house_data
+
+
+# Columns that are generated from the lat/long density instead of the copula
+location_features = ['lat', 'long', 'zipcode']
+
+# Features the log price is regressed on (fitted on the real rows, see HouseDataGenerator.fit)
+price_features = ['bedrooms', 'bathrooms', 'sqft_living', 'sqft_lot', 'floors', 'waterfront', 'view', 'condition', 'grade',
+    'sqft_above', 'sqft_basement', 'yr_built', 'yr_renovated', 'sqft_living15', 'sqft_lot15']
+
+
+# Generates King County-style listings with the same columns and dtypes as kc_house_data.csv
+# - Every feature keeps its empirical marginal, and the features are tied together by a Gaussian copula
+#   (correlation of their normal scores), so e.g. sqft_living / sqft_above / grade stay correlated
+# - lat / long are drawn from a Gaussian kernel density of the real coordinates (bandwidth in degrees),
+#   and zipcode comes from the real row each point was drawn around
+# - log(price) = intercept + standardized features . price_coefs + location_weight * location residual + noise,
+#   with the coefficients, the location residuals of the real rows and the noise scale fitted by least squares.
+#   price_coefs / location_weight / noise can be overridden to control the price relationship.
+class HouseDataGenerator(object):
+    def __init__(self, bandwidth=0.005, price_coefs=None, location_weight=1.0, noise=None):
+        self.bandwidth = bandwidth
+        self.price_coefs = price_coefs
+        self.location_weight = location_weight
+        self.noise = noise
+
+    # X: the real listings, with every column of kc_house_data.csv (see data_cache.load_house_data)
+    def fit(self, X):
+        self.columns = list(X.columns)
+        self.dtypes = {column : X[column].dtype for column in self.columns}
+        self.copula_features = [column for column in featureTypes.keys()
+            if column in self.columns and column not in location_features and column != 'price']
+
+        # Marginals (sorted values) and the correlation of the normal scores
+        values = np.asarray(X[self.copula_features], dtype=np.float64)
+        self.marginals = np.sort(values, axis=0)
+        scores = ndtri((np.apply_along_axis(rankdata, 0, values) - 0.5) / len(values))
+        self.copula_corr = np.corrcoef(scores, rowvar=False)
+        self.copula_chol = np.linalg.cholesky(self.copula_corr + 1e-6 * np.eye(len(self.copula_features)))
+
+        self.latlong = np.asarray(X[['lat', 'long']], dtype=np.float64)
+        self.zipcodes = np.asarray(X['zipcode']) if 'zipcode' in self.columns else None
+        self.dates = np.asarray(X['date']) if 'date' in self.columns else None
+
+        # Log price model on the standardized features
+        features = np.asarray(X[price_features], dtype=np.float64)
+        self.price_mean = features.mean(axis=0)
+        self.price_std = features.std(axis=0)
+        self.price_std[self.price_std == 0] = 1
+        design = np.hstack([np.ones((len(X), 1)), (features - self.price_mean) / self.price_std])
+        log_price = np.log(np.asarray(X['price'], dtype=np.float64))
+        coefs = np.linalg.lstsq(design, log_price, rcond=None)[0]
+        self.intercept = coefs[0]
+        self.fitted_coefs = dict(zip(price_features, coefs[1:]))
+
+        # Location effect: the residual averaged over each real row's 50 nearest rows, the rest is noise
+        residuals = log_price - design @ coefs
+        neighbors = KDTree(self.latlong).query(self.latlong, k=min(50, len(X)), return_distance=False)
+        self.location_residuals = residuals[neighbors].mean(axis=1)
+        self.fitted_noise = np.std(residuals - self.location_residuals)
+        return self
+
+    # Draws n_rows listings
+    # Returns: DataFrame with the columns and dtypes of the real rows
+    def sample(self, n_rows, random_state=None, id_offset=0):
+        rng = np.random.RandomState(random_state) if not isinstance(random_state, np.random.RandomState) else random_state
+        n_real = len(self.latlong)
+        data = {}
+
+        # Copula features: correlated normals -> uniforms -> empirical quantiles (interpolated for continuous features)
+        uniforms = ndtr(rng.standard_normal((n_rows, len(self.copula_features))) @ self.copula_chol.T)
+        positions = uniforms * (n_real - 1)
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, n_real - 1)
+        for j, column in enumerate(self.copula_features):
+            if featureTypes[column] == 'continuous':
+                weight = positions[:, j] - lower[:, j]
+                data[column] = (1 - weight) * self.marginals[lower[:, j], j] + weight * self.marginals[upper[:, j], j]
+            else:
+                data[column] = self.marginals[np.rint(positions[:, j]).astype(np.intp), j]
+
+        # Keeping the square footage consistent (above + basement = living)
+        if 'sqft_above' in data and 'sqft_basement' in data:
+            data['sqft_above'] = np.minimum(np.rint(data['sqft_above']), np.rint(data['sqft_living']))
+            data['sqft_basement'] = np.rint(data['sqft_living']) - data['sqft_above']
+        if 'yr_renovated' in data and 'yr_built' in data:
+            data['yr_renovated'] = np.where(data['yr_renovated'] < data['yr_built'], 0, data['yr_renovated'])
+
+        # Location: kernel density around randomly chosen real rows
+        anchors = rng.randint(0, n_real, size=n_rows)
+        latlong = self.latlong[anchors] + rng.normal(0, self.bandwidth, (n_rows, 2))
+        data['lat'], data['long'] = latlong[:, 0], latlong[:, 1]
+        if self.zipcodes is not None:
+            data['zipcode'] = self.zipcodes[anchors]
+
+        # Price
+        coefs = dict(self.fitted_coefs, **(self.price_coefs or {}))
+        noise = self.fitted_noise if self.noise is None else self.noise
+        features = np.column_stack([data[feature] for feature in price_features])
+        log_price = self.intercept + ((features - self.price_mean) / self.price_std) @ np.array([coefs[f] for f in price_features])
+        log_price += self.location_weight * self.location_residuals[anchors] + rng.normal(0, noise, n_rows)
+        data['price'] = np.round(np.exp(log_price))
+
+        if 'id' in self.columns:
+            data['id'] = np.arange(id_offset, id_offset + n_rows, dtype=np.int64)
+        if self.dates is not None:
+            data['date'] = self.dates[rng.randint(0, n_real, size=n_rows)]
+
+        return pd.DataFrame({column : np.asarray(data[column]).astype(self.dtypes[column]) for column in self.columns},
+            columns=self.columns)
+
+    # Draws n_rows listings chunk_size rows at a time, so the whole set is never held in memory
+    def sample_chunks(self, n_rows, chunk_size=100000, random_state=None):
+        rng = np.random.RandomState(random_state)
+        for start in range(0, n_rows, chunk_size):
+            yield self.sample(min(chunk_size, n_rows - start), random_state=rng, id_offset=start)
+
+    # Writes n_rows listings to a CSV in the format of kc_house_data.csv (loadable with data_cache.load_house_data)
+    def write_csv(self, path, n_rows, chunk_size=100000, random_state=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        for i, chunk in enumerate(self.sample_chunks(n_rows, chunk_size, random_state)):
+            if 'date' in chunk.columns:
+                chunk['date'] = pd.to_datetime(chunk['date']).dt.strftime('%Y%m%dT%H%M%S')
+            chunk.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            print('\t%d / %d rows written' % (min((i + 1) * chunk_size, n_rows), n_rows))
+        return path
+
+
+# Fits a generator on kc_house_data.csv
+def fit_house_generator(path='./data/kc_house_data.csv', **kwargs):
+    return HouseDataGenerator(**kwargs).fit(load_house_data(path))
+
+
+# Command-line Argument handler
+def handle_cl_args():
+    nRows = 1000000
+    outPath = None
+    chunkSize = 100000
+    seed = None
+
+    opts, args = getopt.getopt(sys.argv[1:], 'hn:o:', ['help', 'rows=', 'out=', 'chunk-size=', 'seed='])
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            sys.exit(2)
+        elif opt in ('-n', '--rows'):
+            nRows = int(arg)
+        elif opt in ('-o', '--out'):
+            outPath = arg
+        elif opt == '--chunk-size':
+            chunkSize = int(arg)
+        elif opt == '--seed':
+            seed = int(arg)
+
+    return (nRows, outPath, chunkSize, seed)
+
+
+if __name__ == '__main__':
+    nRows, outPath, chunkSize, seed = handle_cl_args()
+    if outPath is None:
+        outPath = './data/kc_house_synthetic_%d.csv' % (nRows)
+
+    generator = fit_house_generator()
+    generator.write_csv(outPath, nRows, chunk_size=chunkSize, random_state=seed)
+    print('Synthetic listings written to %s' % (outPath))
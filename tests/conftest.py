@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from data_cache import load_house_data
+
+
+# kc_house_data.csv as read by price_predict.py
+@pytest.fixture(scope='session')
+def house_data():
+    return load_house_data(os.path.join(root, 'data', 'kc_house_data.csv'))
+
+
+# Random subsample of the listings with the columns price_predict.py trains on
+# Returns: (X, Y)
+@pytest.fixture(scope='session')
+def house_rows(house_data):
+    rows = house_data.sample(n=3000, random_state=0).reset_index(drop=True)
+    Y = rows[['price']].copy()
+    return rows.drop(['price', 'date', 'id', 'zipcode'], axis=1), Y
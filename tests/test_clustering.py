@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from clustering import dbscan_grid
+
+
+@pytest.fixture(scope='module')
+def latlong(house_data):
+    return np.asarray(house_data[['lat', 'long']].sample(n=5000, random_state=0), dtype=np.float64)
+
+
+# dbscan_grid labels every setting of the grid exactly as DBSCAN(eps, min_samples).fit
+def test_dbscan_grid_matches_dbscan(latlong):
+    eps_vals, min_samples_vals = [0.01, 0.0175, 0.025], [5, 20, 50]
+    results = dbscan_grid(latlong, eps_vals, min_samples_vals)[0]
+
+    assert set(results.keys()) == {(eps, ms) for eps in eps_vals for ms in min_samples_vals}
+    for (eps, min_samples), (labels, core_inds) in results.items():
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples).fit(latlong)
+        np.testing.assert_array_equal(np.sort(core_inds), dbscan.core_sample_indices_)
+        np.testing.assert_array_equal(labels, dbscan.labels_)
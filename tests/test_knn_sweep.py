@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.neighbors import KNeighborsRegressor
+
+from knn_sweep import get_nearest, knn_prefix_sweep
+
+
+@pytest.fixture(scope='module')
+def continuous_rows():
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(rng.normal(size=(600, 6)), columns=['f%d' % (i) for i in range(6)])
+    y = X.to_numpy() @ rng.normal(size=6) + rng.normal(scale=0.5, size=len(X))
+    return X.iloc[:400], y[:400], X.iloc[400:], y[400:]
+
+
+# Without distance ties, every prefix scores as KNeighborsRegressor fitted on it
+@pytest.mark.parametrize('weights', ['distance', 'uniform'])
+@pytest.mark.parametrize('n_neighbors', [1, 3, 5])
+def test_knn_prefix_sweep_matches_knn(continuous_rows, weights, n_neighbors):
+    X_fit, y_fit, X_query, y_query = continuous_rows
+    feature_order = ['f3', 'f0', 'f5', 'f1', 'f4', 'f2']
+    scores = knn_prefix_sweep(X_fit, y_fit, feature_order, X_query, y_query, n_neighbors=n_neighbors, weights=weights,
+        memory_mb=0.5)
+
+    for k in (1, 2, 4, 6):
+        features = feature_order[:k]
+        knn = KNeighborsRegressor(n_neighbors=n_neighbors, weights=weights).fit(X_fit[features], y_fit)
+        np.testing.assert_allclose(scores[k-1], knn.score(X_query[features], y_query), rtol=1e-7)
+
+
+# Ties at the last neighbor go to the lowest row index
+def test_get_nearest_breaks_ties_by_index():
+    distances = np.array([[3., 1., 1., 0., 1., 1.], [2., 2., 2., 2., 2., 2.]])
+    np.testing.assert_array_equal(get_nearest(distances, 3), [[1, 2, 3], [0, 1, 2]])
+
+
+# In-sample scoring of duplicated rows matches a stable (distance, index) sort of the neighbors
+def test_knn_prefix_sweep_ties(house_rows):
+    X, Y = house_rows
+    X_fit, y_fit = X.iloc[:500], Y['price'].to_numpy()[:500]
+    feature_order = ['grade', 'bedrooms', 'floors']
+    scores = knn_prefix_sweep(X_fit, y_fit, feature_order, n_neighbors=5)
+
+    for k in range(1, len(feature_order) + 1):
+        values = X_fit[feature_order[:k]].to_numpy(dtype=np.float64)
+        distances = np.sum(np.square(values[:, None, :] - values[None, :, :]), axis=2)
+        neighbors = np.argsort(distances, axis=1, kind='stable')[:, :5]
+        neighbor_distances = np.take_along_axis(distances, neighbors, axis=1)
+        exact = neighbor_distances == 0
+        with np.errstate(divide='ignore'):
+            weight = np.where(np.any(exact, axis=1)[:, None], exact, 1 / np.sqrt(neighbor_distances))
+        predictions = np.sum(weight * y_fit[neighbors], axis=1) / np.sum(weight, axis=1)
+        expected = 1 - np.sum(np.square(predictions - y_fit)) / np.sum(np.square(y_fit - y_fit.mean()))
+        np.testing.assert_allclose(scores[k-1], expected, rtol=1e-9)
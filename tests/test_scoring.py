@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from sklearn.model_selection import train_test_split
+
+from cluster_model import cluster_model
+from scoring import load_model
+
+methods = ['dbscan', 'kmeans', 'none']
+regressors = ['knn', 'lr', 'pr2', 'decisiontree']
+
+
+@pytest.fixture(scope='module')
+def fitted_model(house_rows, tmp_path_factory):
+    X, Y = house_rows
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=0)
+    cm = cluster_model(X, Y, X_train, X_test, Y_train, Y_test, cluster_methods=methods, regressors=regressors,
+        plot_clusters=False, cluster_plots=False, plotDir=str(tmp_path_factory.mktemp('figures')),
+        dbscan_args={'default_ms' : 20}, random_state=0)
+    return cm, X_test
+
+
+# A saved and reloaded model predicts like the fitted one, memory-mapped or not
+@pytest.mark.parametrize('mmap_mode', ['r', None])
+def test_save_load_predict(fitted_model, tmp_path, mmap_mode):
+    cm, X_test = fitted_model
+    scorer = load_model(cm.save(str(tmp_path / 'model.joblib')), mmap_mode=mmap_mode)
+
+    for method in methods:
+        np.testing.assert_array_equal(scorer.get_clusters(X_test, method), cm.get_clusters(X_test, method))
+        for regressor in regressors:
+            np.testing.assert_allclose(scorer.predict(X_test, method, regressor), cm.predict(X_test, method, regressor))
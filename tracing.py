@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Peak resident set size of this process in MB (None where the resource module is missing)
+# ru_maxrss is in bytes on macOS and in KB on Linux / other Unixes
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 1024
+
+
+# One timed span, written as a JSON line when it exits
+# Records the wall / CPU seconds, row count, peak RSS and any extra fields (method, cluster, regressor, ...)
+class Span(object):
+    def __init__(self, tracer, name, n_rows=None, fields=None):
+        self.tracer = tracer
+        self.name = name
+        self.n_rows = n_rows
+        self.fields = fields
+
+    def __enter__(self):
+        self.tracer.depth += 1
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        self.tracer.depth -= 1
+        record = {
+            'name'        : self.name,
+            'wall'        : wall,
+            'cpu'         : cpu,
+            'n_rows'      : self.n_rows,
+            'peak_rss_mb' : get_peak_rss_mb(),
+            'depth'       : self.tracer.depth,
+            'pid'         : os.getpid(),
+            'run_id'      : self.tracer.run_id,
+            'start'       : time.time() - wall
+        }
+        if self.fields:
+            record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self.tracer.write(record)
+        return False
+
+
+# Span that records nothing (shared by every disabled tracer)
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_span = NullSpan()
+
+
+# Writes timing spans to a JSON-lines trace file
+#   with tracer.span('fit', n_rows=len(X), regressor='knn'):
+#       model.fit(X, Y)
+# Every process appends its own lines to path (the file is opened lazily, so tracers can be sent to
+# fold / regressor worker processes). The file is truncated when the tracer is created (unless truncate=False),
+# and every span is tagged with the tracer's run_id. With path=None or enabled=False, span() returns a shared no-op span.
+class Tracer(object):
+    def __init__(self, path=None, enabled=True, truncate=True):
+        self.path = path
+        self.enabled = enabled and path is not None
+        self.depth = 0
+        self.file = None
+        self.run_id = '%d-%d' % (os.getpid(), time.time_ns())
+        if self.enabled and truncate:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            open(self.path, 'w').close()
+
+    def span(self, name, n_rows=None, **fields):
+        if not self.enabled:
+            return null_span
+        return Span(self, name, n_rows, fields)
+
+    def write(self, record):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps(record, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # The open file stays with the process that opened it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['depth'] = 0
+        return state
+
+
+null_tracer = Tracer(enabled=False)
+
+
+# Reads a trace file into a DataFrame (one row per span)
+def load_trace(path):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+# Total wall / CPU time, calls and max peak RSS of every span name in a trace (of one run when run_id is given)
+def summarize_trace(path, run_id=None):
+    trace = load_trace(path)
+    if run_id is not None:
+        trace = trace[trace['run_id'] == run_id]
+    return trace.groupby('name').agg(calls=('wall', 'size'), wall=('wall', 'sum'), cpu=('cpu', 'sum'),
+        peak_rss_mb=('peak_rss_mb', 'max')).sort_values('wall', ascending=False)
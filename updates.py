@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error
+from scoring import route_clusters, transform_rows
+from regressors import fit_regressor_jobs
+
+
+# Incremental updates of a fitted cluster_model with newly sold listings
+# New rows are routed to their existing clusters (the clusterings and per-cluster scalers are kept as fitted).
+# In the clusters that received rows:
+# - lr / pr2 / pr3 are re-solved in place from running normal equations (X'X and X'y of every row seen)
+# - knn is refitted on the appended rows (its fit is only the neighbor index)
+# - the other regressors are refitted only when the cluster grew by more than row_threshold since their
+#   last fit, or their RMSE on the new rows is more than error_threshold above their RMSE on the test rows
+# Clusters without new rows are not touched.
+
+# Regressors that are updated on every batch of new rows
+linear_regressors = ['lr', 'pr2', 'pr3']
+index_regressors = ['knn']
+
+
+# Running sums of a least squares problem, so the fit can be re-solved after appending rows
+# without revisiting the old ones
+class NormalEquations(object):
+    def __init__(self, n_features):
+        self.n = 0
+        self.sum_x = np.zeros(n_features)
+        self.sum_y = 0.0
+        self.xtx = np.zeros((n_features, n_features))
+        self.xty = np.zeros(n_features)
+
+    def update(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.n += len(X)
+        self.sum_x += X.sum(axis=0)
+        self.sum_y += y.sum()
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        return self
+
+    # Least squares solution with an intercept (from the centered sums)
+    # Returns: (coef, intercept)
+    def solve(self):
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+        sxx = self.xtx - self.n * np.outer(mean_x, mean_x)
+        sxy = self.xty - self.n * mean_x * mean_y
+        coef = np.linalg.lstsq(sxx, sxy, rcond=None)[0]
+        return coef, mean_y - mean_x @ coef
+
+
+# Design matrix of a cluster's regressor for raw rows X, and its current train / test matrices
+def get_design(cluster, regressor, X):
+    if regressor == 'pr2' or regressor == 'pr3':
+        return cluster[regressor]['poly_transform'].transform(X)
+    return transform_rows(cluster['transform_state'], X)[cluster['features']]
+
+
+def get_train_design(cluster, regressor):
+    if regressor == 'pr2' or regressor == 'pr3':
+        return cluster[regressor]['X_train']
+    return cluster['X_train']
+
+
+def get_test_design(cluster, regressor):
+    if regressor == 'pr2' or regressor == 'pr3':
+        return cluster[regressor]['X_test']
+    return cluster['X_test']
+
+
+# Adds a cluster's new rows to its linear regressor and re-solves the coefficients
+def update_linear(entry, X_train, Y_train, X_new, Y_new):
+    if 'normal_equations' not in entry.keys():
+        entry['normal_equations'] = NormalEquations(np.shape(X_train)[1]).update(X_train, Y_train)
+    entry['normal_equations'].update(X_new, Y_new)
+    entry['model'].coef_, entry['model'].intercept_ = entry['normal_equations'].solve()
+
+
+# Updates the clusters of one clustering method with new rows X (raw features, same columns as X_train) and prices Y
+# Returns: List of {'method', 'cluster', 'n_new', 'n_train', 'updated', 'refitted'} for the clusters that got rows
+def update_method(cm, method, X, Y, row_threshold=0.25, error_threshold=0.25, min_error_rows=10):
+    method_model = cm.models[method]
+    labels = route_clusters(method_model, method, X)
+    summary = []
+    jobs = []
+
+    order = np.argsort(labels, kind='stable')
+    clusters, starts = np.unique(labels[order], return_index=True)
+    for label, rows in zip(clusters, np.split(order, starts[1:])):
+        if label not in method_model.keys():
+            print('Skipping %d new rows of %s cluster %s (not a fitted cluster)' % (len(rows), method, str(label)))
+            continue
+
+        cluster = method_model[label]
+        X_rows = X.iloc[rows]
+        Y_rows = Y.iloc[rows].reset_index(drop=True)
+        record = {'method' : method, 'cluster' : label, 'n_new' : len(rows), 'updated' : [], 'refitted' : []}
+
+        # Deciding on refits before the new rows are appended
+        refit = []
+        for regressor in cm.regressors:
+            if regressor in linear_regressors or regressor in index_regressors or regressor not in cluster.keys():
+                continue
+            entry = cluster[regressor]
+            entry.setdefault('n_fit', cluster['n_train'])
+            if 'test_rmse' not in entry.keys():
+                entry['test_rmse'] = mean_squared_error(cluster['Y_test']['price'],
+                    entry['model'].predict(get_test_design(cluster, regressor)), squared=False)
+
+            grown = (cluster['n_train'] + len(rows)) / entry['n_fit'] - 1 > row_threshold
+            drifted = False
+            if len(rows) >= min_error_rows:
+                new_rmse = mean_squared_error(Y_rows['price'], entry['model'].predict(get_design(cluster, regressor, X_rows)),
+                    squared=False)
+                drifted = new_rmse > (1 + error_threshold) * entry['test_rmse']
+            if grown or drifted:
+                refit.append(regressor)
+
+        # Appending the rows to the cluster's training data
+        X_design = transform_rows(cluster['transform_state'], X_rows)[cluster['features']].reset_index(drop=True)
+        for regressor in cm.regressors:
+            if regressor not in cluster.keys():
+                continue
+            if regressor in linear_regressors:
+                X_old, X_new = get_train_design(cluster, regressor), get_design(cluster, regressor, X_rows)
+                update_linear(cluster[regressor], X_old, cluster['Y_train']['price'], X_new, Y_rows['price'])
+                if regressor == 'pr2' or regressor == 'pr3':
+                    cluster[regressor]['X_train'] = np.vstack([X_old, X_new])
+                record['updated'].append(regressor)
+
+        cluster['X_train'] = pd.concat([cluster['X_train'], X_design], ignore_index=True)
+        cluster['Y_train'] = pd.concat([cluster['Y_train'], Y_rows], ignore_index=True)
+        cluster['n_train'] = len(cluster['X_train'])
+
+        for regressor in cm.regressors:
+            if regressor in index_regressors and regressor in cluster.keys():
+                cluster[regressor]['model'].fit(cluster['X_train'], cluster['Y_train']['price'])
+                record['updated'].append(regressor)
+
+        for regressor in refit:
+            jobs.append((method, label, regressor, cluster['X_train'], cluster['Y_train']['price']))
+            record['refitted'].append(regressor)
+
+        record['n_train'] = cluster['n_train']
+        summary.append(record)
+
+    # Expensive refits of every drifted cluster share one pool of workers
+    results = fit_regressor_jobs(jobs, n_jobs=cm.n_jobs, n_cores=cm.n_cores, random_state=cm.random_state,
+        tune=cm.tune_regressors, tuning_args=cm.tuning_args, early_stopping=cm.early_stopping,
+        early_stopping_args=cm.early_stopping_args, tracer=cm.tracer, fold=cm.fold)
+    for _, label, regressor, fitted, fit_time, info in results:
+        entry = method_model[label][regressor]
+        entry['model'] = fitted
+        entry['fit_time'] = fit_time
+        entry['n_fit'] = method_model[label]['n_train']
+        entry.pop('test_rmse', None)
+        if 'params' in info.keys():
+            entry['params'] = info['params']
+            cm.tuned_params[(method, label, regressor)] = info['params']
+        cm.fit_times[(method, label, regressor)] = fit_time
+
+    return summary
+
+
+# Updates every clustering method of a fitted cluster_model with new rows (see update_method)
+# Returns: DataFrame with one row per (method, cluster) that got new rows
+def update_model(cm, X, Y, row_threshold=0.25, error_threshold=0.25, min_error_rows=10):
+    if not isinstance(Y, pd.DataFrame):
+        Y = pd.DataFrame({'price' : np.asarray(Y)}, index=X.index)
+
+    summary = []
+    for method in cm.cluster_methods:
+        summary.extend(update_method(cm, method, X, Y, row_threshold, error_threshold, min_error_rows))
+    return pd.DataFrame(summary, columns=['method', 'cluster', 'n_new', 'n_train', 'updated', 'refitted'])